@@ -0,0 +1,140 @@
+"""
+Recall and latency of two-stage quantized vector search against today's float search.
+
+    uv run python -m scripts.benchmark_quantization --corpus "<user_email>_<project>" --quantization binary
+    uv run python -m scripts.benchmark_quantization --corpus "..." --queries questions.txt -k 10
+    uv run python -m scripts.benchmark_quantization --backfill binary
+
+Without --queries, stored embeddings of randomly sampled chunks of the corpus are used as
+query vectors (no Voyage calls). --backfill fills `embedding_quantized` on chunks ingested
+before VECTOR_QUANTIZATION was enabled; the quantized Atlas index only sees chunks that have it.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from typing import List
+
+from pymongo import UpdateOne
+
+from src.config import get_settings
+from src.db.mongo import db
+from src.retrieval.service import SearchService
+from src.retrieval.vector_index import VectorIndex
+from src.services.vectors import decode_embedding, quantize_embedding
+
+def chunks_collection():
+    return db.client[get_settings().MONGODB_DATABASE]["chunks"]
+
+async def backfill(quantization: str, batch_size: int = 1000):
+    query = {"embedding_quantized": None}
+    total = await chunks_collection().count_documents(query)
+    print(f"Quantizing {total} chunks ({quantization})")
+    done = 0
+    ops = []
+    async for doc in chunks_collection().find(query, {"embedding": 1}):
+        ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"embedding_quantized": quantize_embedding(doc["embedding"], quantization)}}))
+        if len(ops) >= batch_size:
+            await chunks_collection().bulk_write(ops, ordered=False)
+            done += len(ops)
+            ops = []
+            print(f"  {done}/{total}")
+    if ops:
+        await chunks_collection().bulk_write(ops, ordered=False)
+        done += len(ops)
+    print(f"Done: {done} chunks")
+
+async def load_queries(corpus: str, path: str, samples: int) -> List[List[float]]:
+    if path:
+        with open(path) as f:
+            texts = [line.strip() for line in f if line.strip()]
+        return await SearchService.embed_queries(texts)
+    cursor = chunks_collection().aggregate([
+        {"$match": {"user_corpus": corpus}},
+        {"$sample": {"size": samples}},
+        {"$project": {"embedding": 1}},
+    ])
+    return [decode_embedding(doc["embedding"]).tolist() async for doc in cursor]
+
+async def atlas_searcher(quantization: str):
+    settings = get_settings()
+
+    async def search(query: List[float], corpus: str, k: int) -> List[str]:
+        settings.VECTOR_QUANTIZATION = quantization
+        return [str(doc["_id"]) for doc in await SearchService._atlas_vector_search(query, corpus, k)]
+    return search
+
+async def local_searcher(corpus: str, quantization: str):
+    # A private index per mode: codes are only built when VECTOR_QUANTIZATION is set at load time
+    get_settings().VECTOR_QUANTIZATION = quantization
+    index = VectorIndex()
+    index.add_chunks(await chunks_collection().find(
+        {"user_corpus": corpus}, {"embedding": 1, "user_corpus": 1, "document_id": 1, "content": 1}
+    ).to_list(length=None))
+
+    async def search(query: List[float], corpus: str, k: int) -> List[str]:
+        return [doc["_id"] for doc in index.search(query, corpus, k)]
+    return search
+
+async def measure(search, queries: List[List[float]], corpus: str, k: int):
+    ids, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        ids.append(await search(query, corpus, k))
+        latencies.append((time.perf_counter() - start) * 1000)
+    return ids, latencies
+
+def report(name: str, latencies: List[float]):
+    latencies = sorted(latencies)
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    print(f"{name:<12} p50 {statistics.median(latencies):8.2f} ms   p95 {p95:8.2f} ms")
+
+async def benchmark(args):
+    settings = get_settings()
+    settings.VECTOR_RESCORE_FACTOR = args.rescore_factor
+    queries = await load_queries(args.corpus, args.queries, args.samples)
+    if not queries:
+        print(f"No queries (is '{args.corpus}' empty?)")
+        return
+
+    if settings.VECTOR_BACKEND == "local":
+        exact = await local_searcher(args.corpus, "none")
+        quantized = await local_searcher(args.corpus, args.quantization)
+    else:
+        exact = await atlas_searcher("none")
+        quantized = await atlas_searcher(args.quantization)
+
+    exact_ids, exact_latencies = await measure(exact, queries, args.corpus, args.k)
+    quantized_ids, quantized_latencies = await measure(quantized, queries, args.corpus, args.k)
+
+    recalls = [len(set(e) & set(q)) / len(e) for e, q in zip(exact_ids, quantized_ids) if e]
+    print(f"{len(queries)} queries, backend={settings.VECTOR_BACKEND}, k={args.k}, "
+          f"quantization={args.quantization}, rescore factor={args.rescore_factor}")
+    report("float", exact_latencies)
+    report("two-stage", quantized_latencies)
+    print(f"recall@{args.k}    {statistics.mean(recalls):.4f} (min {min(recalls):.2f})")
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", help="user_corpus to benchmark")
+    parser.add_argument("--quantization", choices=["binary", "int8"], default="binary")
+    parser.add_argument("--queries", help="File with one question per line (embedded with Voyage)")
+    parser.add_argument("--samples", type=int, default=200, help="Sampled chunk embeddings to query with when --queries is not given")
+    parser.add_argument("-k", type=int, default=20)
+    parser.add_argument("--rescore-factor", type=int, default=get_settings().VECTOR_RESCORE_FACTOR)
+    parser.add_argument("--backfill", choices=["binary", "int8"], help="Fill embedding_quantized on existing chunks and exit")
+    args = parser.parse_args()
+
+    await db.connect()
+    try:
+        if args.backfill:
+            await backfill(args.backfill)
+        elif args.corpus:
+            await benchmark(args)
+        else:
+            parser.error("--corpus or --backfill is required")
+    finally:
+        await db.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -10,11 +10,98 @@ class Settings(BaseSettings):
     VOYAGE_API_KEY: str
     VOYAGE_MODEL: str = "voyage-3-large" 
     VOYAGE_RERANK_MODEL: str = "rerank-2.5"
+    RERANK_CACHE_SIZE: int = 1024
+    RERANK_CACHE_TTL_SECONDS: int = 3600
+    RERANK_MAX_TOKENS_PER_DOC: int = 0 # Truncate candidates to about this many tokens before reranking (0 = full text)
+    RERANK_SKIP_MARGIN: float = 0.0 # Skip rerank when top fused score beats the runner-up by this fraction (0 = never)
+
+    # Document embedding during ingestion
+    EMBED_BATCH_MAX_ITEMS: int = 128 # Voyage allows up to 1000 per request
+    EMBED_BATCH_MAX_TOKENS: int = 100000 # Stays under voyage-3-large's 120K tokens per request
+    EMBED_CONCURRENCY: int = 4 # Batches embedding/inserting at once per document
+    EMBED_MAX_RETRIES: int = 5
+    EMBED_RETRY_BASE_SECONDS: float = 1.0
+    EMBEDDING_STORAGE: str = "array" # "array" (BSON doubles) or "binary" (packed float32 BinData)
+    DEDUP_ENABLED: bool = True # Reuse parses/embeddings of identical files and chunk texts within a corpus
     VECTOR_SEARCH_WEIGHT: float = 0.5 
+
+    # Query embedding cache
+    EMBEDDING_CACHE_SIZE: int = 2048
+    EMBEDDING_CACHE_TTL_SECONDS: int = 3600
+    EMBEDDING_CACHE_SHARED: bool = False # Also persist entries in Mongo so all workers share them
+
+    # Query embedding micro-batching (coalesces concurrent requests into one Voyage call)
+    EMBED_BATCH_WINDOW_MS: float = 5.0
+    EMBED_BATCH_MAX_SIZE: int = 64
+
+    # Vector search backend: "atlas" ($vectorSearch) or "local" (in-process index built from `chunks`)
+    VECTOR_BACKEND: str = "atlas"
+    VECTOR_NUM_CANDIDATES: int = 100
+    # Two-stage search: over-fetch with quantized vectors, then rescore with full precision ("none", "binary", "int8")
+    VECTOR_QUANTIZATION: str = "none"
+    VECTOR_RESCORE_FACTOR: int = 8 # Quantized candidates fetched per result
+    VECTOR_INDEX_HNSW_THRESHOLD: int = 20000 # Corpus size above which the local index uses HNSW (needs hnswlib)
+    LOCAL_INDEX_POLL_SECONDS: float = 5.0 # Only used when change streams are unavailable
+
+    # Keyword search backend: "atlas" ($search on text_index) or "local" (in-process BM25)
+    KEYWORD_BACKEND: str = "atlas"
     
     # Gemini (LLM)
     GEMINI_API_KEY: str
     GEMINI_MODEL: str = "gemini-2.5-flash-lite"
+    REWRITE_CACHE_SIZE: int = 4096 # Cached multi-query variations / decompositions
+    REWRITE_CACHE_TTL_SECONDS: int = 86400
+
+    # Prompt context: best chunks first, adjacent chunks merged, until the budget is used up
+    CONTEXT_MAX_TOKENS: int = 4000
+
+    # Semantic answer cache for /chat/query (invalidated per corpus on ingest/delete)
+    SEMANTIC_CACHE_ENABLED: bool = False # Answer paraphrases of earlier questions from stored answers
+    SEMANTIC_CACHE_THRESHOLD: float = 0.95 # Min cosine similarity between queries to reuse an answer
+    SEMANTIC_CACHE_MAX_ENTRIES: int = 256 # Answers kept per (user_corpus, rag_strategy)
+    SEMANTIC_CACHE_MAX_CORPORA: int = 1024
+    SEMANTIC_CACHE_TTL_SECONDS: int = 3600
+
+    # Per-request search deadline; optional stages degrade instead of blocking past their budget
+    SEARCH_DEADLINE_SECONDS: float = 10.0 # 0 disables deadlines
+    REWRITE_BUDGET_SECONDS: float = 3.0 # LLM query variations / decomposition; falls back to the plain query
+    RERANK_BUDGET_SECONDS: float = 3.0 # Falls back to fused order
+    KEYWORD_GRACE_SECONDS: float = 0.5 # How long hybrid search waits for the keyword leg after the vector leg
+
+    # /chat/batch-query
+    BATCH_MAX_QUERIES: int = 500
+    BATCH_SEARCH_CONCURRENCY: int = 8 # Searches (incl. rerank) in flight per batch; shares the Motor pool with live traffic
+    BATCH_LLM_CONCURRENCY: int = 4 # Answer generations in flight per batch
+
+    # Chunking (token counts use CHUNK_TOKENIZER, loaded once per parser process and at API startup)
+    CHUNK_TOKENIZER: str = "sentence-transformers/all-MiniLM-L6-v2"
+    CHUNK_MAX_TOKENS: int = 512
+    CHUNK_OVERLAP_TOKENS: int = 64 # Carried over between consecutive chunks of the token-window chunker
+
+    # Ingestion worker
+    PARSER_POOL_SIZE: int = 2 # Pre-warmed Docling parser processes (0 parses in a thread instead)
+    PDF_RANGE_PAGES: int = 40 # Longer PDFs are converted in page ranges of this size, in parallel (0 disables)
+    INGESTION_CONCURRENCY: int = 2 # Ingestion tasks processed at once by one worker
+    INGESTION_MAX_PER_TENANT: int = 0 # Max tasks of one user_corpus running at once across workers (0 = no cap)
+    INGESTION_POLL_SECONDS: float = 1.0 # Queue polling interval when idle
+    INGESTION_LEASE_SECONDS: float = 120.0 # Running tasks not renewed for this long (crashed worker) are requeued
+    INGESTION_MAX_REQUEUES: int = 2 # Then the task and its file are marked failed
+    INGESTION_SMALL_FILE_BYTES: int = 512 * 1024 # At or below: high priority (as are markdown / plain text)
+    INGESTION_LARGE_FILE_BYTES: int = 20 * 1024 * 1024 # At or above: low priority
+
+    # /files/upload-batch
+    BULK_UPLOAD_CONCURRENCY: int = 8 # Files / archive members streamed into GridFS at once
+    BULK_MAX_FILES: int = 5000 # Files per batch, counting archive members
+
+    # /files/events (ingestion progress)
+    PROGRESS_POLL_SECONDS: float = 2.0 # Only used when change streams are unavailable
+    PROGRESS_HEARTBEAT_SECONDS: float = 15.0
+
+    # Uploads larger than this are rejected (0 disables the limit)
+    MAX_UPLOAD_BYTES: int = 200 * 1024 * 1024
+
+    # Adds a Server-Timing header with per-stage durations to API responses
+    SERVER_TIMING_ENABLED: bool = False
 
     # API Auth (Simple Admin Key since Clerk is removed)
     ADMIN_API_KEY: str = "secret-admin-key" 
@@ -1,37 +1,28 @@
 import logging
-from typing import List, Any, Optional
-from dataclasses import dataclass
+from typing import Dict, List, Any, Iterator, Optional, Tuple
+
+from src.ingestion.text_chunker import ChunkResult, TokenWindow, heading_path, paragraphs
 
 try:
     from docling.chunking import HybridChunker
-    from docling_core.types.doc import DoclingDocument
-    from transformers import AutoTokenizer
+    from docling_core.transforms.chunker.tokenizer.huggingface import HuggingFaceTokenizer
+    from docling_core.types.doc import DoclingDocument, SectionHeaderItem, TableItem, TitleItem
 except ImportError:
     HybridChunker = None
+    HuggingFaceTokenizer = None
     DoclingDocument = None
-    AutoTokenizer = None
 
 logger = logging.getLogger(__name__)
 
-@dataclass
-class ChunkResult:
-    text: str
-    metadata: dict
-
 class DocumentChunker:
-    def __init__(self, chunk_size=1000, chunk_overlap=200):
-        self.chunk_size = chunk_size
-        self.chunk_overlap = chunk_overlap
+    def __init__(self, max_tokens: Optional[int] = None, overlap_tokens: Optional[int] = None):
+        self.tokens = TokenWindow(max_tokens, overlap_tokens)
         self.chunker = None
-        self.tokenizer = None
-        
-        if HybridChunker and AutoTokenizer:
+
+        if HybridChunker and self.tokens.tokenizer is not None:
             try:
-                # Initialize tokenizer for better precision
-                model_id = "sentence-transformers/all-MiniLM-L6-v2"
-                self.tokenizer = AutoTokenizer.from_pretrained(model_id)
                 self.chunker = HybridChunker(
-                    tokenizer=self.tokenizer,
+                    tokenizer=HuggingFaceTokenizer(tokenizer=self.tokens.tokenizer, max_tokens=self.tokens.max_tokens),
                     merge_peers=True
                 )
                 logger.info("HybridChunker initialized successfully.")
@@ -39,34 +30,73 @@ class DocumentChunker:
                 logger.warning(f"Failed to init HybridChunker: {e}")
 
     def chunk(self, doc: Any) -> List[ChunkResult]:
+        return list(self.iter_chunks(doc))
+
+    def iter_chunks(self, doc: Any) -> Iterator[ChunkResult]:
         """
-        Chunk a DoclingDocument using HybridChunker if available,
-        otherwise fall back to simple text splitting.
+        Chunk a DoclingDocument using HybridChunker if available, otherwise with a sliding
+        token window over the document's items. Chunks are yielded as they are produced.
         """
         # 1. Try Hybrid Contextual Chunking
         if self.chunker and isinstance(doc, DoclingDocument):
+            produced = 0
             try:
-                chunk_iter = self.chunker.chunk(dl_doc=doc)
-                results = []
-                for chunk in chunk_iter:
+                paths = _heading_paths(doc)
+                for chunk in self.chunker.chunk(dl_doc=doc):
                     # The Magic: Contextualize prepends hierarchy (e.g. "Header 1 > Subheader > content")
                     text = self.chunker.contextualize(chunk=chunk)
-                    results.append(ChunkResult(text=text, metadata={"method": "hybrid"}))
-                return results
+                    produced += 1
+                    items = chunk.meta.doc_items
+                    yield ChunkResult(text=text, metadata={
+                        "method": "hybrid",
+                        "headings": chunk.meta.headings or [],
+                        # (level, text) of those headings, so a page range's chunks can be re-rooted
+                        "heading_path": paths.get(items[0].self_ref, []) if items else [],
+                    })
+                return
             except Exception as e:
+                if produced:
+                    # Falling back now would store the first part of the document twice
+                    raise
                 logger.error(f"Hybrid chunking failed: {e}. Falling back.")
 
-        # 2. Fallback: Simple Markdown Splitting
-        if hasattr(doc, "export_to_markdown"):
-             text = doc.export_to_markdown()
+        # 2. Fallback: token window over the document, without materializing it as one string
+        pieces = _docling_pieces(doc) if DoclingDocument and isinstance(doc, DoclingDocument) else paragraphs(str(doc))
+        for text in self.tokens.window(pieces):
+            yield ChunkResult(text=text, metadata={"method": "window"})
+
+def _docling_pieces(doc: Any) -> Iterator[str]:
+    """Markdown of each item in reading order; the document is never exported as a whole."""
+    for item, _level in doc.iterate_items():
+        if isinstance(item, TableItem):
+            text = item.export_to_markdown(doc=doc)
+        elif isinstance(item, TitleItem):
+            text = f"# {item.text}"
+        elif isinstance(item, SectionHeaderItem):
+            text = f"{'#' * (item.level + 1)} {item.text}"
+        else:
+            text = getattr(item, "text", "")
+        if text and text.strip():
+            yield text
+
+def _heading_paths(doc: Any) -> Dict[str, List[Tuple[int, str]]]:
+    """(level, text) of the headings open at each non-heading item of a DoclingDocument, by self_ref."""
+    paths, path = {}, []
+    for item, _level in doc.iterate_items():
+        if isinstance(item, TitleItem):
+            path = heading_path(path, [(0, item.text)])
+        elif isinstance(item, SectionHeaderItem):
+            path = heading_path(path, [(item.level, item.text)])
         else:
-             text = str(doc)
-             
-        return self._simple_chunk(text)
+            paths[item.self_ref] = path
+    return paths
 
-    def _simple_chunk(self, text: str) -> List[ChunkResult]:
-        chunks = []
-        for i in range(0, len(text), self.chunk_size - self.chunk_overlap):
-            chunk_text = text[i:i + self.chunk_size]
-            chunks.append(ChunkResult(text=chunk_text, metadata={"method": "simple"}))
-        return chunks
+def document_headings(doc: Any) -> List[Tuple[int, str]]:
+    """(level, text) of the title and section headers of a DoclingDocument, in reading order."""
+    headings = []
+    for item, _level in doc.iterate_items():
+        if isinstance(item, TitleItem):
+            headings.append((0, item.text))
+        elif isinstance(item, SectionHeaderItem):
+            headings.append((item.level, item.text))
+    return headings
@@ -0,0 +1,257 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, Dict, List, Tuple
+
+try:
+    import pypdfium2 # Installed with docling
+except ImportError:
+    pypdfium2 = None
+
+from src.config import get_settings
+from src.ingestion.text_chunker import ChunkResult, heading_path, with_heading_context
+from src.services.metrics import INGESTION_STAGE_SECONDS, observe
+
+logger = logging.getLogger(__name__)
+
+# Parser state for the current process, built once and reused for every document
+_converter = None
+_chunker = None
+_init_lock = threading.Lock()
+_parse_lock = threading.Lock()
+
+def _init_parser():
+    global _converter, _chunker
+    with _init_lock:
+        if _chunker is not None:
+            return
+        # Lazy import DocumentConverter to save RAM in processes that never parse
+        try:
+            from docling.document_converter import DocumentConverter
+        except ImportError:
+            DocumentConverter = None
+
+        from src.ingestion.chunker import DocumentChunker
+        _converter = DocumentConverter() if DocumentConverter else None
+        _chunker = DocumentChunker()
+        logger.info(f"Parser ready in process {os.getpid()}")
+
+def _warm() -> int:
+    _init_parser()
+    return os.getpid()
+
+class _Cancelled(Exception):
+    pass
+
+def _put(out, cancel, item):
+    # Blocks while the consumer is behind (backpressure), but gives up once it has gone away
+    while not cancel.is_set():
+        try:
+            out.put(item, timeout=0.5)
+            return
+        except queue.Full:
+            continue
+    raise _Cancelled()
+
+def stream_file(path: str, out, cancel, batch_size: int) -> Dict[str, float]:
+    """
+    Convert a file with Docling and put its chunks on `out` in batches as the chunker yields
+    them, followed by None. Runs inside a pool process (or a thread).
+    Returns the parse/chunk durations, since pool processes can't report metrics themselves.
+    """
+    try:
+        _init_parser()
+        if _converter is None:
+            _put(out, cancel, [ChunkResult(text="Mock Content (Docling missing)", metadata={"method": "mock"})])
+            return {}
+
+        with _parse_lock:
+            start = time.perf_counter()
+            result = _converter.convert(path)
+            chunk_seconds = 0.0
+            timings = {"parse": time.perf_counter() - start}
+
+            batch = []
+            chunks = _chunker.iter_chunks(result.document) # DoclingDocument
+            while True:
+                started = time.perf_counter()
+                chunk = next(chunks, None)
+                chunk_seconds += time.perf_counter() - started
+                if chunk is None:
+                    break
+                batch.append(chunk)
+                if len(batch) >= batch_size:
+                    _put(out, cancel, batch)
+                    batch = []
+            if batch:
+                _put(out, cancel, batch)
+            timings["chunk"] = chunk_seconds
+            return timings
+    except _Cancelled:
+        return {}
+    finally:
+        try:
+            out.put(None, timeout=1) # End of stream; dropped if the consumer is gone
+        except queue.Full:
+            pass
+
+def parse_range(path: str, first_page: int, last_page: int) -> Tuple[List[ChunkResult], List[Tuple[int, str]], Dict[str, float]]:
+    """
+    Convert and chunk pages first_page..last_page (1-based, inclusive) of a PDF.
+    Also returns the range's headings, so the heading context can be carried into the next range.
+    """
+    _init_parser()
+    if _converter is None:
+        return [], [], {}
+    from src.ingestion.chunker import document_headings
+
+    with _parse_lock:
+        start = time.perf_counter()
+        result = _converter.convert(path, page_range=(first_page, last_page))
+        parsed = time.perf_counter()
+        chunks = _chunker.chunk(result.document)
+        timings = {"parse": parsed - start, "chunk": time.perf_counter() - parsed}
+        return chunks, document_headings(result.document), timings
+
+def pdf_page_count(path: str) -> int:
+    """Page count of a PDF (0 for anything else or an unreadable file), without parsing it."""
+    if pypdfium2 is None or not path.lower().endswith(".pdf"):
+        return 0
+    try:
+        pdf = pypdfium2.PdfDocument(path)
+    except Exception:
+        return 0 # Let Docling report the error
+    try:
+        return len(pdf)
+    finally:
+        pdf.close()
+
+class ParserPool:
+    """
+    Pool of pre-warmed parser processes, each holding a persistent DocumentConverter
+    and DocumentChunker. Without a pool, parsing runs in a thread of the current process
+    with the same persistent parser, so the event loop is never blocked.
+    """
+    # Chunk batches parsed ahead of the embedder; bounds a document's chunks held in memory
+    buffer_batches = 4
+
+    def __init__(self):
+        self.executor: ProcessPoolExecutor = None
+        self.manager = None
+        self.size = 0
+
+    def start(self, size: int):
+        if size <= 0 or self.executor is not None:
+            return
+        # spawn: the worker already runs threads (health server), which fork does not handle safely
+        context = multiprocessing.get_context("spawn")
+        self.executor = ProcessPoolExecutor(
+            max_workers=size,
+            mp_context=context,
+            initializer=_init_parser,
+        )
+        self.size = size
+        # Queues chunks travel on from the pool processes back to the worker
+        self.manager = context.Manager()
+        # Start and warm every process now instead of on the first documents
+        pids = {future.result() for future in [self.executor.submit(_warm) for _ in range(size)]}
+        logger.info(f"Parser pool started with {len(pids)} warm process(es)")
+
+    async def stream(self, path: str, batch_size: int) -> AsyncIterator[List[ChunkResult]]:
+        """
+        Yield the chunks of a file in batches while it is still being chunked. Parsing pauses
+        when buffer_batches are waiting, so memory is bounded by the window, not the document.
+        PDFs longer than PDF_RANGE_PAGES are converted in page ranges, in parallel across the pool.
+        """
+        range_pages = get_settings().PDF_RANGE_PAGES
+        pages = pdf_page_count(path) if range_pages > 0 else 0
+        if pages > range_pages:
+            async for batch in self._stream_ranges(path, pages, range_pages, batch_size):
+                yield batch
+            return
+
+        if self.executor is None:
+            out, cancel = queue.Queue(maxsize=self.buffer_batches), threading.Event()
+            future = asyncio.ensure_future(asyncio.to_thread(stream_file, path, out, cancel, batch_size))
+        else:
+            out, cancel = self.manager.Queue(maxsize=self.buffer_batches), self.manager.Event()
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self.executor, stream_file, path, out, cancel, batch_size)
+
+        try:
+            while True:
+                try:
+                    batch = await asyncio.to_thread(out.get, True, 1.0)
+                except queue.Empty:
+                    if future.done(): # The parser died without ending the stream (e.g. a killed pool process)
+                        break
+                    continue
+                if batch is None:
+                    break
+                yield batch
+        finally:
+            cancel.set()
+            # Retrieve the error of a parse abandoned mid-stream so it isn't reported as never retrieved
+            future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        # Raises the parser's error, if the stream ended because parsing failed
+        timings = await future
+        for stage, seconds in timings.items():
+            observe(stage, seconds, INGESTION_STAGE_SECONDS)
+
+    async def _stream_ranges(self, path: str, pages: int, range_pages: int, batch_size: int) -> AsyncIterator[List[ChunkResult]]:
+        """
+        Convert page ranges on up to `size` pool processes at once and yield their chunks in page
+        order as soon as every earlier range is done, so the start of a long PDF becomes searchable
+        while the rest is still being converted.
+        """
+        ranges = iter([(first, min(first + range_pages - 1, pages)) for first in range(1, pages + 1, range_pages)])
+        logger.info(f"Parsing {pages}-page PDF in ranges of {range_pages} pages")
+        loop = asyncio.get_running_loop()
+
+        def submit(page_range: Tuple[int, int]) -> asyncio.Future:
+            if self.executor is None:
+                return asyncio.ensure_future(asyncio.to_thread(parse_range, path, *page_range))
+            return loop.run_in_executor(self.executor, parse_range, path, *page_range)
+
+        in_flight = deque()
+        path_headings: List[Tuple[int, str]] = []
+        try:
+            for page_range in ranges:
+                in_flight.append(submit(page_range))
+                if len(in_flight) >= max(self.size, 1):
+                    break
+
+            while in_flight:
+                chunks, headings, timings = await in_flight.popleft()
+                # Keep the pool busy while this range's chunks are embedded
+                page_range = next(ranges, None)
+                if page_range is not None:
+                    in_flight.append(submit(page_range))
+
+                for stage, seconds in timings.items():
+                    observe(stage, seconds, INGESTION_STAGE_SECONDS)
+                chunks = [with_heading_context(chunk, path_headings) for chunk in chunks]
+                path_headings = heading_path(path_headings, headings)
+                for i in range(0, len(chunks), batch_size):
+                    yield chunks[i:i + batch_size]
+        finally:
+            for future in in_flight:
+                future.cancel()
+                future.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+            self.size = 0
+        if self.manager is not None:
+            self.manager.shutdown()
+            self.manager = None
+
+parser_pool = ParserPool()
@@ -0,0 +1,318 @@
+import asyncio
+import hashlib
+import logging
+import random
+from collections import defaultdict
+from typing import AsyncIterable, Dict, List, Optional, Set, Tuple
+
+from beanie import PydanticObjectId
+from pymongo import UpdateOne
+from pymongo.errors import OperationFailure
+from voyageai import error as voyage_error
+
+from src.config import get_settings
+from src.db.mongo import db
+from src.models.files import FileMetadata, Chunk, ChunkEmbedding, ChunkRef
+from src.services.voyage import get_voyage_client, make_batches
+from src.services.vectors import EmbeddingValue, encode_embedding, quantize_embedding
+from src.services.metrics import DEDUP_CHUNKS, DEDUP_FILES, INGESTION_STAGE_SECONDS, timed
+from src.retrieval.index_sync import index_sync
+from src.ingestion.progress import ProgressReporter
+
+logger = logging.getLogger(__name__)
+
+# Returned by servers that can't run transactions (standalone mongod)
+ILLEGAL_OPERATION = 20
+
+# Errors worth retrying; anything else (bad request, auth) fails the document immediately
+RETRYABLE_ERRORS = (
+    voyage_error.RateLimitError,
+    voyage_error.ServiceUnavailableError,
+    voyage_error.ServerError,
+    voyage_error.Timeout,
+    voyage_error.APIConnectionError,
+    voyage_error.TryAgain,
+)
+
+class DedupStats:
+    """Per-process counters for content-hash reuse during ingestion, mirrored to the metrics registry."""
+    def __init__(self):
+        self.files_total = 0
+        self.files_reused = 0
+        self.chunks_total = 0
+        self.chunks_reused = 0
+
+    def record_file(self, reused: bool):
+        self.files_total += 1
+        self.files_reused += int(reused)
+        DEDUP_FILES.labels(result="reused" if reused else "new").inc()
+
+    def record_chunks(self, total: int, reused: int):
+        self.chunks_total += total
+        self.chunks_reused += reused
+        DEDUP_CHUNKS.labels(result="reused").inc(reused)
+        DEDUP_CHUNKS.labels(result="new").inc(total - reused)
+
+    def stats(self) -> dict:
+        return {
+            "files_total": self.files_total,
+            "files_reused": self.files_reused,
+            "file_hit_rate": self.files_reused / self.files_total if self.files_total else 0.0,
+            "chunks_total": self.chunks_total,
+            "chunks_reused": self.chunks_reused,
+            "chunk_hit_rate": self.chunks_reused / self.chunks_total if self.chunks_total else 0.0,
+        }
+
+dedup_stats = DedupStats()
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+class EmbeddingPipeline:
+    """
+    Embeds a document's chunks in token-budgeted batches with bounded concurrency and
+    inserts each batch as soon as it is embedded. Chunks already stored for the document
+    are skipped, so re-running a document after a crash only embeds what is missing.
+    Chunks whose text was already embedded with the same model in the same user_corpus
+    reuse the stored embedding instead of calling Voyage.
+    """
+    def __init__(self, file_meta: FileMetadata, progress: Optional[ProgressReporter] = None):
+        self.file_meta = file_meta
+        self.progress = progress
+        self.settings = get_settings()
+        self.inserted = 0
+        self.reused = 0
+
+    async def _existing_indexes(self) -> Set[int]:
+        return set(await Chunk.distinct("chunk_index", {"document_id": str(self.file_meta.id)}))
+
+    async def run(self, chunks: AsyncIterable[List[str]]) -> int:
+        """
+        Embed and store chunk texts as the parser produces them (`chunks` yields them in order,
+        in batches), so a large document never has to be held in memory as a whole.
+        """
+        existing = await self._existing_indexes()
+        if existing:
+            logger.info(f"Resuming {self.file_meta.filename}: {len(existing)} chunks already stored")
+
+        # Caps how many batches are embedding or inserting at once (and so peak memory)
+        slots = asyncio.Semaphore(self.settings.EMBED_CONCURRENCY)
+        tasks: Set[asyncio.Task] = set()
+        total = embedded = 0
+        buffer: List[Tuple[int, str]] = []
+        try:
+            async for texts in chunks:
+                if self.progress:
+                    if total == 0:
+                        await self.progress.stage("embedding", chunks_total=len(texts), chunks_embedded=len(existing))
+                    else:
+                        await self.progress.update(chunks_total=total + len(texts))
+                pending = [(i, text) for i, text in enumerate(texts, start=total) if i not in existing]
+                total += len(texts)
+                embedded += len(pending)
+
+                batches = list(make_batches(buffer + pending, self.settings.EMBED_BATCH_MAX_TOKENS, self.settings.EMBED_BATCH_MAX_ITEMS))
+                # The last batch may still fill up with the next chunks
+                buffer = batches.pop() if batches else []
+                for batch in batches:
+                    await self._submit(batch, slots, tasks)
+            if buffer:
+                await self._submit(buffer, slots, tasks)
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+
+        if embedded and self.settings.DEDUP_ENABLED:
+            logger.info(f"Reused {self.reused}/{embedded} stored embeddings for {self.file_meta.filename}")
+        return len(existing) + self.inserted
+
+    async def _submit(self, batch: List[Tuple[int, str]], slots: asyncio.Semaphore, tasks: Set[asyncio.Task]):
+        await slots.acquire()
+        task = asyncio.create_task(self._process_batch(batch))
+        task.add_done_callback(lambda _: slots.release())
+        tasks.add(task)
+        # Surface failures early instead of embedding the rest of the document
+        for done in [t for t in tasks if t.done()]:
+            tasks.discard(done)
+            done.result()
+
+    async def copy_from(self, source_document_id: str) -> int:
+        """
+        Copy the chunks of an identical, already ingested file of the same user_corpus.
+        Returns 0 when the source has no chunks embedded with the current model.
+        """
+        existing = await self._existing_indexes()
+        if self.progress:
+            await self.progress.update(chunks_embedded=len(existing))
+        query = Chunk.find(
+            Chunk.document_id == source_document_id,
+            Chunk.user_corpus == self.file_meta.user_corpus,
+            Chunk.embedding_model == self.settings.VOYAGE_MODEL,
+        ).sort("chunk_index")
+
+        copied = 0
+        batch = []
+        async for source in query:
+            copied += 1
+            if source.chunk_index in existing:
+                continue
+            batch.append(self._make_chunk(source.chunk_index, source.content, source.embedding, source.content_hash))
+            if len(batch) >= self.settings.EMBED_BATCH_MAX_ITEMS:
+                await self._insert(batch)
+                batch = []
+        if batch:
+            await self._insert(batch)
+        if self.progress:
+            await self.progress.update(chunks_total=copied)
+        return copied
+
+    async def update(self, chunks_text: List[str]) -> Dict[str, int]:
+        """
+        Bring the stored chunks of the document in line with a new version. Chunks whose content
+        hash is unchanged are kept (re-indexed if they moved), only new texts are embedded, and
+        chunks that disappeared are deleted. The swap happens in one transaction when the server
+        supports it; otherwise new chunks are inserted before old ones are removed, so searches
+        never see the document empty.
+        """
+        stored = await Chunk.find(Chunk.document_id == str(self.file_meta.id)).project(ChunkRef).to_list()
+        by_hash: Dict[str, List[ChunkRef]] = defaultdict(list)
+        for ref in sorted(stored, key=lambda r: r.chunk_index):
+            if ref.content_hash:
+                by_hash[ref.content_hash].append(ref)
+
+        moved: Dict[PydanticObjectId, int] = {}
+        kept = set()
+        added: List[Tuple[int, str]] = []
+        for i, text in enumerate(chunks_text):
+            refs = by_hash.get(content_hash(text))
+            if refs:
+                ref = refs.pop(0)
+                kept.add(ref.id)
+                if ref.chunk_index != i:
+                    moved[ref.id] = i
+            else:
+                added.append((i, text))
+        removed = [ref.id for ref in stored if ref.id not in kept]
+        if self.progress:
+            await self.progress.stage("embedding", chunks_total=len(chunks_text), chunks_embedded=len(kept))
+
+        # Embed everything new before touching the stored version
+        slots = asyncio.Semaphore(self.settings.EMBED_CONCURRENCY)
+
+        async def prepare(batch: List[Tuple[int, str]]) -> List[Chunk]:
+            async with slots:
+                return await self._prepare_batch(batch)
+
+        prepared = await asyncio.gather(*(
+            prepare(batch) for batch in make_batches(added, self.settings.EMBED_BATCH_MAX_TOKENS, self.settings.EMBED_BATCH_MAX_ITEMS)
+        ))
+        new_chunks = [chunk for batch in prepared for chunk in batch]
+        for chunk in new_chunks:
+            chunk.id = PydanticObjectId() # Known up front for the index hooks below
+
+        try:
+            async with await db.client.start_session() as session:
+                async with session.start_transaction():
+                    await self._swap(new_chunks, moved, removed, session)
+        except OperationFailure as e:
+            if e.code != ILLEGAL_OPERATION:
+                raise
+            await self._swap(new_chunks, moved, removed, None)
+
+        index_sync.add_chunks({**c.model_dump(exclude={"id", "revision_id"}), "_id": c.id} for c in new_chunks)
+        index_sync.update_chunks({"_id": _id, "chunk_index": i} for _id, i in moved.items())
+        index_sync.remove_chunks(str(_id) for _id in removed)
+        self.inserted += len(new_chunks)
+        if self.progress and new_chunks:
+            await self.progress.embedded(len(new_chunks))
+
+        counts = {"kept": len(kept), "embedded": len(new_chunks), "removed": len(removed), "moved": len(moved)}
+        logger.info(f"Updated {self.file_meta.filename}: {counts}")
+        return counts
+
+    async def _swap(self, new_chunks: List[Chunk], moved: Dict[PydanticObjectId, int], removed: List[PydanticObjectId], session):
+        # Insert first: without a transaction, searches briefly see both versions rather than neither
+        if new_chunks:
+            await Chunk.insert_many(new_chunks, session=session)
+        chunks = Chunk.get_motor_collection()
+        if moved:
+            await chunks.bulk_write(
+                [UpdateOne({"_id": _id}, {"$set": {"chunk_index": i}}) for _id, i in moved.items()],
+                ordered=False, session=session,
+            )
+        if removed:
+            await chunks.delete_many({"_id": {"$in": removed}}, session=session)
+
+    def _make_chunk(self, chunk_index: int, text: str, embedding: EmbeddingValue, text_hash: str) -> Chunk:
+        return Chunk(
+            document_id=str(self.file_meta.id),
+            user_corpus=self.file_meta.user_corpus,
+            user_email=self.file_meta.user_email,
+            chunk_index=chunk_index,
+            content=text,
+            content_hash=text_hash,
+            embedding=encode_embedding(embedding),
+            embedding_model=self.settings.VOYAGE_MODEL,
+            embedding_quantized=quantize_embedding(embedding, self.settings.VECTOR_QUANTIZATION),
+            metadata={"source": self.file_meta.filename}
+        )
+
+    async def _stored_embeddings(self, hashes: List[str]) -> Dict[str, EmbeddingValue]:
+        # Scoped to this user_corpus so reuse never crosses tenants
+        stored = await Chunk.find(
+            Chunk.user_corpus == self.file_meta.user_corpus,
+            Chunk.embedding_model == self.settings.VOYAGE_MODEL,
+            {"content_hash": {"$in": hashes}},
+        ).project(ChunkEmbedding).to_list()
+        return {c.content_hash: c.embedding for c in stored}
+
+    async def _process_batch(self, batch: List[Tuple[int, str]]):
+        await self._insert(await self._prepare_batch(batch))
+
+    async def _prepare_batch(self, batch: List[Tuple[int, str]]) -> List[Chunk]:
+        """Embed a batch (reusing stored embeddings of identical texts) into Chunk documents."""
+        hashes = [content_hash(text) for _, text in batch]
+        known = await self._stored_embeddings(list(set(hashes))) if self.settings.DEDUP_ENABLED else {}
+
+        # Embed each distinct unseen text once
+        missing = {h: text for h, (_, text) in zip(hashes, batch) if h not in known}
+        if missing:
+            embeddings = await self._embed_with_retry(list(missing.values()))
+            known.update(zip(missing.keys(), embeddings))
+
+        reused = len(batch) - len(missing)
+        self.reused += reused
+        dedup_stats.record_chunks(len(batch), reused)
+
+        return [self._make_chunk(i, text, known[h], h) for (i, text), h in zip(batch, hashes)]
+
+    async def _insert(self, chunk_docs: List[Chunk]):
+        with timed("insert", INGESTION_STAGE_SECONDS):
+            result = await Chunk.insert_many(chunk_docs, ordered=False)
+        # Keeps local indexes current when ingestion runs in the serving process
+        index_sync.add_chunks(
+            {**c.model_dump(exclude={"id", "revision_id"}), "_id": _id}
+            for c, _id in zip(chunk_docs, result.inserted_ids)
+        )
+        self.inserted += len(chunk_docs)
+        if self.progress:
+            await self.progress.embedded(len(chunk_docs))
+
+    async def _embed_with_retry(self, texts: List[str]) -> List[List[float]]:
+        vo = get_voyage_client()
+        attempts = self.settings.EMBED_MAX_RETRIES + 1
+        for attempt in range(attempts):
+            try:
+                with timed("embed", INGESTION_STAGE_SECONDS):
+                    result = await asyncio.to_thread(
+                        vo.embed, texts, model=self.settings.VOYAGE_MODEL, input_type="document"
+                    )
+                return result.embeddings
+            except RETRYABLE_ERRORS as e:
+                if attempt == attempts - 1:
+                    raise
+                delay = self.settings.EMBED_RETRY_BASE_SECONDS * (2 ** attempt) * (1 + random.random())
+                logger.warning(f"Embedding batch of {len(texts)} failed ({e}); retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
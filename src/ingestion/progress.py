@@ -0,0 +1,136 @@
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Set
+
+from beanie import PydanticObjectId
+from pymongo.errors import OperationFailure
+
+from src.config import get_settings
+from src.models.files import FileMetadata
+
+logger = logging.getLogger(__name__)
+
+# Fields of a FileMetadata that make up a progress event
+PROGRESS_FIELDS = ("user_email", "filename", "status", "stage", "chunks_total", "chunks_embedded", "error_message", "updated_at")
+
+class ProgressReporter:
+    """
+    Publishes ingestion progress of one file with targeted $set/$inc updates, so concurrent
+    embedding batches never overwrite each other (unlike save(), which replaces the document).
+    """
+    def __init__(self, file_id: PydanticObjectId):
+        self.file_id = file_id
+
+    async def update(self, inc: Optional[Dict[str, int]] = None, **fields: Any):
+        update: Dict[str, Any] = {"$set": {**fields, "updated_at": datetime.now()}}
+        if inc:
+            update["$inc"] = inc
+        await FileMetadata.get_motor_collection().update_one({"_id": self.file_id}, update)
+
+    async def stage(self, stage: str, **fields: Any):
+        await self.update(stage=stage, **fields)
+
+    async def embedded(self, count: int):
+        await self.update(inc={"chunks_embedded": count})
+
+def to_event(doc: Dict[str, Any]) -> Dict[str, Any]:
+    event = {"file_id": str(doc["_id"])}
+    for field in PROGRESS_FIELDS:
+        value = doc.get(field)
+        event[field] = value.isoformat() if isinstance(value, datetime) else value
+    event.pop("user_email")
+    return event
+
+class ProgressHub:
+    """
+    Fans out file progress changes to per-user subscriber queues (one per open SSE stream).
+    A single change stream on `files` serves every subscriber of the process; on a standalone
+    MongoDB the hub polls `updated_at` of subscribed users' files instead.
+    """
+    queue_size = 1000
+    poll_lookback = timedelta(seconds=60)
+
+    def __init__(self):
+        self.subscribers: Dict[str, Set[asyncio.Queue]] = defaultdict(set)
+        self._task: asyncio.Task = None
+        self._seen: Dict[str, datetime] = {} # file_id -> last updated_at sent (polling only)
+
+    def subscribe(self, user_email: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self.subscribers[user_email].add(queue)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._watch())
+        return queue
+
+    def unsubscribe(self, user_email: str, queue: asyncio.Queue):
+        queues = self.subscribers.get(user_email)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self.subscribers[user_email]
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _dispatch(self, doc: Dict[str, Any]):
+        queues = self.subscribers.get(doc.get("user_email"))
+        if not queues:
+            return
+        event = to_event(doc)
+        for queue in queues:
+            if queue.full():
+                queue.get_nowait() # A slow client loses the oldest update, never blocks the hub
+            queue.put_nowait(event)
+
+    async def _watch(self):
+        pipeline = [
+            {"$match": {"operationType": {"$in": ["insert", "update", "replace"]}}},
+            {"$project": {"fullDocument._id": 1, **{f"fullDocument.{f}": 1 for f in PROGRESS_FIELDS}}},
+        ]
+        while True:
+            try:
+                async with FileMetadata.get_motor_collection().watch(pipeline, full_document="updateLookup") as stream:
+                    async for change in stream:
+                        if change.get("fullDocument"):
+                            self._dispatch(change["fullDocument"])
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                logger.info(f"Change streams unavailable ({e}); polling file progress instead")
+                await self._poll()
+                return
+            except Exception as e:
+                # Network errors and elections must not leave open event streams with heartbeats only
+                logger.warning(f"File progress change stream interrupted: {e}; reconnecting")
+                await asyncio.sleep(1)
+
+    async def _poll(self):
+        interval = get_settings().PROGRESS_POLL_SECONDS
+        projection = {"_id": 1, **{f: 1 for f in PROGRESS_FIELDS}}
+        while True:
+            users = list(self.subscribers)
+            if users:
+                since = datetime.now() - self.poll_lookback
+                try:
+                    cursor = FileMetadata.get_motor_collection().find(
+                        {"user_email": {"$in": users}, "updated_at": {"$gt": since}}, projection
+                    ).sort("updated_at", 1)
+                    async for doc in cursor:
+                        file_id = str(doc["_id"])
+                        if self._seen.get(file_id) != doc["updated_at"]:
+                            self._seen[file_id] = doc["updated_at"]
+                            self._dispatch(doc)
+                    self._seen = {k: v for k, v in self._seen.items() if v > since}
+                except Exception as e:
+                    logger.warning(f"Polling file progress failed: {e}")
+            await asyncio.sleep(interval)
+
+progress_hub = ProgressHub()
@@ -1,80 +1,169 @@
+import asyncio
 import os
-import tempfile
-import voyageai
+import time
+from contextlib import AsyncExitStack, aclosing
+from itertools import islice
+from typing import AsyncIterable, AsyncIterator, List, Optional
 from src.services.storage import StorageService
-from src.models.files import FileMetadata, Chunk
+from src.models.files import Chunk, FileMetadata
 from src.config import get_settings
+from src.ingestion.pipeline import EmbeddingPipeline, dedup_stats
+from src.ingestion.parser_pool import parser_pool
+from src.ingestion.progress import ProgressReporter
+from src.ingestion.text_chunker import get_markdown_chunker, is_plain_text, read_lines
+from src.retrieval.answer_cache import corpus_versions
+from src.retrieval.index_sync import index_sync
+from src.services.metrics import INGESTION_STAGE_SECONDS, observe, timed
 import logging
 
 logger = logging.getLogger(__name__)
 
 class IngestionService:
     @staticmethod
-    async def process_document(file_id: str):
+    async def _reuse_identical_file(file_meta: FileMetadata, progress: ProgressReporter) -> bool:
+        """Copy chunks from an identical file already ingested in the same corpus, skipping parse and embed."""
+        if not file_meta.content_hash:
+            return False
+
+        source = await FileMetadata.find_one(
+            FileMetadata.user_corpus == file_meta.user_corpus,
+            FileMetadata.content_hash == file_meta.content_hash,
+            FileMetadata.status == "completed",
+            FileMetadata.id != file_meta.id,
+        )
+        if not source:
+            return False
+
+        await progress.stage("reusing")
+        copied = await EmbeddingPipeline(file_meta, progress).copy_from(str(source.id))
+        if copied:
+            logger.info(f"Reused {copied} chunks of identical file {source.id} for {file_meta.filename}")
+        return copied > 0
+
+    @staticmethod
+    async def _stream_plain_text(file_meta: FileMetadata, progress: ProgressReporter, text: Optional[str]) -> AsyncIterator[List[str]]:
+        """
+        Fast path for markdown / plain text: no Docling, milliseconds of CPU per batch.
+        Stored files are streamed to a temp file (bounded by MAX_UPLOAD_BYTES) and chunked
+        line by line as the embedder asks for batches, so the whole text is never in memory.
+        """
+        settings = get_settings()
+        async with AsyncExitStack() as stack:
+            if text is None:
+                await progress.stage("downloading")
+                with timed("download", INGESTION_STAGE_SECONDS):
+                    tmp_path = await stack.enter_async_context(StorageService.download_to_tempfile(
+                        file_meta.gridfs_id,
+                        suffix=f"_{os.path.basename(file_meta.filename)}",
+                        max_bytes=settings.MAX_UPLOAD_BYTES
+                    ))
+                source = read_lines(stack.enter_context(open(tmp_path, encoding="utf-8", errors="replace")))
+            else:
+                source = text
+
+            await progress.stage("parsing")
+            chunks = get_markdown_chunker().iter_chunks(source)
+            next_batch = lambda: [c.text for c in islice(chunks, settings.EMBED_BATCH_MAX_ITEMS)]
+            chunk_seconds = 0.0
+            while True:
+                start = time.perf_counter()
+                batch = await asyncio.to_thread(next_batch)
+                chunk_seconds += time.perf_counter() - start
+                if not batch:
+                    break
+                yield batch
+            observe("chunk", chunk_seconds, INGESTION_STAGE_SECONDS)
+
+    @staticmethod
+    async def process_document(file_id: str, text: Optional[str] = None):
+        """
+        Parse, embed and store a file. `text` is the already known content of a markdown or
+        plain-text file (e.g. a Q&A session), which then skips the GridFS download.
+        """
         settings = get_settings()
         file_meta = await FileMetadata.get(file_id)
         if not file_meta:
             raise Exception("Metadata not found")
-        
+
+        # Status and progress are written with field updates; save() would race the embedding batches
+        progress = ProgressReporter(file_meta.id)
+        # A new version of an already ingested file (PUT /files/{file_id})
+        is_update = file_meta.previous_gridfs_id is not None
         try:
-            # 1. Download
-            file_data = await StorageService.download_file(file_meta.gridfs_id)
-            
-            with tempfile.NamedTemporaryFile(delete=False, suffix=f"_{file_meta.filename}") as tmp:
-                tmp.write(file_data)
-                tmp_path = tmp.name
-            
-            # 2. Parse (Docling)
-            # Lazy import DocumentConverter to save RAM
-            try:
-                from docling.document_converter import DocumentConverter
-            except ImportError:
-                DocumentConverter = None
-
-            if DocumentConverter:
-                converter = DocumentConverter()
-                result = converter.convert(tmp_path)
-                doc = result.document # DoclingDocument
-                
-                # Use our new robust chunker
-                from src.ingestion.chunker import DocumentChunker
-                chunker = DocumentChunker()
-                chunks = chunker.chunk(doc)
-                
-                # Extract text for embedding
-                chunks_text = [c.text for c in chunks]
-            else:
-                chunks_text = ["Mock Content (Docling missing)"]
-
-            # 3. Embed (Voyage AI)
-            vo = voyageai.Client(api_key=settings.VOYAGE_API_KEY)
-            
-            # Batch embedding
-            if chunks_text:
-                # voyage-3 returns list of embeddings
-                embeddings = vo.embed(chunks_text, model=settings.VOYAGE_MODEL, input_type="document").embeddings
-                
-                chunk_docs = []
-                for i, text in enumerate(chunks_text):
-                    chunk_docs.append(Chunk(
-                        document_id=str(file_meta.id),
-                        user_corpus=file_meta.user_corpus,
-                        user_email=file_meta.user_email,
-                        chunk_index=i,
-                        content=text,
-                        embedding=embeddings[i],
-                        metadata={"source": file_meta.filename}
+            reused = not is_update and settings.DEDUP_ENABLED and await IngestionService._reuse_identical_file(file_meta, progress)
+            dedup_stats.record_file(reused)
+            if reused:
+                await progress.update(status="completed", stage="completed")
+                await corpus_versions.bump(file_meta.user_corpus)
+                return
+
+            if text is not None or is_plain_text(file_meta.content_type, file_meta.filename):
+                async with aclosing(IngestionService._stream_plain_text(file_meta, progress, text)) as texts:
+                    await IngestionService._embed_and_store(file_meta, progress, is_update, texts)
+                await IngestionService._complete(file_meta, progress, is_update)
+                return
+
+            # 1. Download, streamed straight to a temp file that is always cleaned up
+            await progress.stage("downloading")
+            async with AsyncExitStack() as stack:
+                with timed("download", INGESTION_STAGE_SECONDS):
+                    tmp_path = await stack.enter_async_context(StorageService.download_to_tempfile(
+                        file_meta.gridfs_id,
+                        suffix=f"_{os.path.basename(file_meta.filename)}",
+                        max_bytes=settings.MAX_UPLOAD_BYTES
                     ))
-                
-                await Chunk.insert_many(chunk_docs)
-                logger.info(f"Successfully created embedding and stored {len(chunk_docs)} chunks for {file_meta.filename}")
+                # 2. Parse (Docling) + chunk, in the warm parser pool, streamed in batches
+                await progress.stage("parsing")
+                chunks = await stack.enter_async_context(aclosing(
+                    parser_pool.stream(tmp_path, batch_size=settings.EMBED_BATCH_MAX_ITEMS)
+                ))
+                texts = ([c.text for c in batch] async for batch in chunks)
+
+                # 3. Embed (Voyage AI) + 4. Store, pipelined batch by batch while parsing continues
+                await IngestionService._embed_and_store(file_meta, progress, is_update, texts)
 
-            file_meta.status = "completed"
-            await file_meta.save()
-            os.unlink(tmp_path)
+            await IngestionService._complete(file_meta, progress, is_update)
 
         except Exception as e:
-            file_meta.status = "failed"
-            file_meta.error_message = str(e)
-            await file_meta.save()
+            if not is_update:
+                # An update only swaps chunks in once the new version is fully embedded
+                await IngestionService.discard_partial(file_meta)
+            await progress.update(status="failed", stage="failed", error_message=str(e))
             raise e
+
+    @staticmethod
+    async def discard_partial(file_meta: FileMetadata):
+        """
+        Delete the chunks a failed ingestion already stored, so search and dedup never treat a
+        failed file's partial chunk set as content. Not used when a worker crashes: its requeued
+        task resumes from the stored chunks, which are only discarded if the task is abandoned.
+        """
+        try:
+            await Chunk.find(Chunk.document_id == str(file_meta.id)).delete()
+            index_sync.remove_document(file_meta.user_corpus, str(file_meta.id))
+            await corpus_versions.bump(file_meta.user_corpus)
+        except Exception as e:
+            logger.warning(f"Could not delete the partial chunks of {file_meta.filename}: {e}")
+
+    @staticmethod
+    async def _embed_and_store(file_meta: FileMetadata, progress: ProgressReporter, is_update: bool, texts: AsyncIterable[List[str]]):
+        if is_update:
+            # Only changed chunks are embedded; the stored version is swapped in place,
+            # which needs the whole new version first
+            await EmbeddingPipeline(file_meta, progress).update([t async for batch in texts for t in batch])
+        else:
+            stored = await EmbeddingPipeline(file_meta, progress).run(texts)
+            logger.info(f"Successfully created embedding and stored {stored} chunks for {file_meta.filename}")
+
+    @staticmethod
+    async def _complete(file_meta: FileMetadata, progress: ProgressReporter, is_update: bool):
+        done = {"status": "completed", "stage": "completed"}
+        if is_update:
+            try:
+                await StorageService.delete_file(file_meta.previous_gridfs_id)
+            except Exception as e:
+                logger.warning(f"Could not delete previous version of {file_meta.filename}: {e}")
+            done.update(previous_gridfs_id=None, error_message=None)
+        await progress.update(**done)
+        # New content is searchable now; cached answers for this corpus are stale
+        await corpus_versions.bump(file_meta.user_corpus)
@@ -0,0 +1,206 @@
+import logging
+import os
+import re
+from collections import deque
+from dataclasses import dataclass
+from functools import lru_cache, partial
+from itertools import chain, groupby
+from typing import IO, Iterable, Iterator, List, Optional, Tuple, Union
+
+from src.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+# Token estimate when no tokenizer is available (same pessimistic ratio as embedding batches)
+CHARS_PER_TOKEN = 3
+
+# Ingested natively by MarkdownChunker instead of Docling
+PLAIN_TEXT_CONTENT_TYPES = ("text/markdown", "text/x-markdown", "text/plain")
+PLAIN_TEXT_SUFFIXES = (".md", ".markdown", ".txt")
+
+# Longer lines, and runs of lines without a blank one, are cut there, so memory stays bounded on any input
+MAX_PARAGRAPH_CHARS = 64 * 1024
+
+HEADING = re.compile(r"^ {0,3}(#{1,6})[ \t]+(.*?)(?:[ \t]+#+)?[ \t]*$")
+FENCE = re.compile(r"^ {0,3}(```|~~~)")
+
+@dataclass
+class ChunkResult:
+    text: str
+    metadata: dict
+
+def is_plain_text(content_type: Optional[str], filename: Optional[str]) -> bool:
+    if (content_type or "").split(";")[0].strip() in PLAIN_TEXT_CONTENT_TYPES:
+        return True
+    return os.path.splitext(filename or "")[1].lower() in PLAIN_TEXT_SUFFIXES
+
+@lru_cache(maxsize=None)
+def get_tokenizer(model_id: str):
+    """One tokenizer per process and model, shared by every chunker. None when transformers is missing."""
+    try:
+        from transformers import AutoTokenizer
+    except ImportError:
+        return None
+    try:
+        return AutoTokenizer.from_pretrained(model_id)
+    except Exception as e:
+        logger.warning(f"Failed to load tokenizer {model_id}: {e}")
+        return None
+
+def heading_path(path: List[Tuple[int, str]], headings: Iterable[Tuple[int, str]]) -> List[Tuple[int, str]]:
+    """Headings still open after `headings` follow `path`; each heading closes those at its level or deeper."""
+    path = list(path)
+    for level, text in headings:
+        while path and path[-1][0] >= level:
+            path.pop()
+        path.append((level, text))
+    return path
+
+def with_heading_context(chunk: ChunkResult, path: List[Tuple[int, str]]) -> ChunkResult:
+    """
+    Prefix a hybrid chunk of a page range with the headings open at the end of the previous
+    ranges that its own (range-local) headings don't close, as contextualize would have for
+    the unsplit document. Chunks before the range's first heading get the whole path.
+    """
+    local = chunk.metadata.get("heading_path")
+    if not path or chunk.metadata.get("method") != "hybrid" or local is None:
+        return chunk
+    full = heading_path(path, local)
+    # The chunk's own headings always end the full path and are already in its text
+    carried = [text for _, text in full[:len(full) - len(local)]]
+    if not carried:
+        return chunk
+    return ChunkResult(
+        text="\n".join(carried + [chunk.text]),
+        metadata={**chunk.metadata, "headings": [text for _, text in full], "heading_path": full},
+    )
+
+def paragraphs(text: str) -> Iterator[str]:
+    for match in re.finditer(r"\S(?:.|\n(?!\s*\n))*", text):
+        yield match.group(0).rstrip()
+
+class TokenWindow:
+    """Packs text pieces into token-bounded, overlapping chunks, counted with CHUNK_TOKENIZER."""
+    def __init__(self, max_tokens: Optional[int] = None, overlap_tokens: Optional[int] = None):
+        settings = get_settings()
+        self.max_tokens = max_tokens or settings.CHUNK_MAX_TOKENS
+        self.overlap_tokens = min(overlap_tokens if overlap_tokens is not None else settings.CHUNK_OVERLAP_TOKENS, self.max_tokens // 2)
+        self.tokenizer = get_tokenizer(settings.CHUNK_TOKENIZER)
+
+    def count_tokens(self, text: str) -> int:
+        if self.tokenizer is None:
+            return len(text) // CHARS_PER_TOKEN + 1
+        return len(self.tokenizer.encode(text, add_special_tokens=False, verbose=False))
+
+    def window(self, pieces: Iterable[str], max_tokens: Optional[int] = None) -> Iterator[str]:
+        """
+        Pack consecutive pieces (paragraphs, tables, headings) into chunks of at most max_tokens,
+        each starting with up to overlap_tokens of trailing pieces from the previous chunk.
+        Pieces larger than a chunk are split on token boundaries.
+        """
+        max_tokens = max_tokens or self.max_tokens
+        overlap_tokens = min(self.overlap_tokens, max_tokens // 2)
+        window: deque = deque() # (text, tokens)
+        total = 0
+        fresh = False # Window holds pieces not yet emitted
+
+        for piece in pieces:
+            tokens = self.count_tokens(piece)
+            if tokens > max_tokens:
+                if fresh:
+                    yield "\n\n".join(text for text, _ in window)
+                window.clear()
+                total, fresh = 0, False
+                yield from self._split(piece, max_tokens, overlap_tokens)
+                continue
+
+            if total + tokens > max_tokens:
+                if fresh:
+                    yield "\n\n".join(text for text, _ in window)
+                    fresh = False
+                # Keep only the overlap tail, and only as much of it as still fits with this piece
+                while window and (total > overlap_tokens or total + tokens > max_tokens):
+                    total -= window.popleft()[1]
+            window.append((piece, tokens))
+            total += tokens
+            fresh = True
+
+        if fresh:
+            yield "\n\n".join(text for text, _ in window)
+
+    def _split(self, text: str, max_tokens: int, overlap_tokens: int) -> Iterator[str]:
+        spans = self._token_spans(text)
+        step = max_tokens - overlap_tokens
+        for start in range(0, len(spans), step):
+            end = min(start + max_tokens, len(spans))
+            yield text[spans[start][0]:spans[end - 1][1]]
+            if end == len(spans):
+                break
+
+    def _token_spans(self, text: str) -> List[Tuple[int, int]]:
+        """Character (start, end) of each token, so chunks are cut from the original text."""
+        if self.tokenizer is None or not getattr(self.tokenizer, "is_fast", False):
+            return [(i, min(i + CHARS_PER_TOKEN, len(text))) for i in range(0, len(text), CHARS_PER_TOKEN)]
+        encoding = self.tokenizer(text, add_special_tokens=False, return_offsets_mapping=True, verbose=False)
+        return encoding["offset_mapping"]
+
+class MarkdownChunker:
+    """
+    Heading-aware chunker for markdown and plain text, without Docling. Every section is
+    chunked on its own (a Q&A pair stays one chunk) and each chunk is prefixed with its
+    heading path, in the same "heading\\nsubheading\\ntext" form as HybridChunker.contextualize.
+    """
+    def __init__(self, max_tokens: Optional[int] = None, overlap_tokens: Optional[int] = None):
+        self.tokens = TokenWindow(max_tokens, overlap_tokens)
+
+    def chunk(self, text: str) -> List[ChunkResult]:
+        return list(self.iter_chunks(text))
+
+    def iter_chunks(self, text: Union[str, Iterable[str]]) -> Iterator[ChunkResult]:
+        """`text` is the whole document or its lines (e.g. from read_lines), which are consumed lazily."""
+        lines = text.splitlines() if isinstance(text, str) else text
+        for _, section in groupby(_paragraphs(lines), key=lambda p: p[0]):
+            _, path, first = next(section)
+            headings = [heading for _, heading in path]
+            prefix = "\n".join(headings)
+            # The heading path is repeated in every chunk of the section, so it counts against the budget
+            budget = max(self.tokens.max_tokens - self.tokens.count_tokens(prefix), self.tokens.max_tokens // 2) if prefix else None
+            pieces = chain([first], (paragraph for _, _, paragraph in section))
+            for piece in self.tokens.window(pieces, budget):
+                yield ChunkResult(text=f"{prefix}\n{piece}" if prefix else piece, metadata={"method": "markdown", "headings": headings})
+
+def read_lines(file: IO[str]) -> Iterator[str]:
+    """Lines of an open text file, none longer than MAX_PARAGRAPH_CHARS."""
+    return iter(partial(file.readline, MAX_PARAGRAPH_CHARS), "")
+
+def _paragraphs(lines: Iterable[str]) -> Iterator[Tuple[int, List[Tuple[int, str]], str]]:
+    """
+    (section number, open headings, paragraph) for every paragraph, in order. Headings inside
+    code fences are ignored; paragraphs are split by blank lines or at MAX_PARAGRAPH_CHARS.
+    """
+    path: List[Tuple[int, str]] = []
+    section = 0
+    paragraph: List[str] = []
+    size = 0
+    fence = None
+    for line in lines:
+        line = line.rstrip("\r\n")
+        marker = FENCE.match(line)
+        if marker:
+            fence = None if fence == marker.group(1) else (fence or marker.group(1))
+        heading = HEADING.match(line) if fence is None and not marker else None
+        if paragraph and (heading or not line.strip() or size > MAX_PARAGRAPH_CHARS):
+            yield section, path, "\n".join(paragraph).strip()
+            paragraph, size = [], 0
+        if heading:
+            section += 1
+            path = heading_path(path, [(len(heading.group(1)), heading.group(2).strip())])
+        elif line.strip():
+            paragraph.append(line)
+            size += len(line)
+    if paragraph:
+        yield section, path, "\n".join(paragraph).strip()
+
+@lru_cache(maxsize=1)
+def get_markdown_chunker() -> MarkdownChunker:
+    return MarkdownChunker()
@@ -1,7 +1,12 @@
-from beanie import Document
-from pydantic import Field
+from beanie import Document, PydanticObjectId
+from bson import Binary
+from pydantic import BaseModel, Field, InstanceOf
+from pymongo import ASCENDING, DESCENDING, IndexModel
 from datetime import datetime
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Union
+
+# BSON array of doubles, or packed float32 BinData (subtype 9) when EMBEDDING_STORAGE=binary
+Embedding = Union[List[float], InstanceOf[Binary]]
 
 class FileMetadata(Document):
     user_corpus: str
@@ -10,12 +15,42 @@ class FileMetadata(Document):
     gridfs_id: str
     file_size: int
     content_type: str
+    content_hash: Optional[str] = None # sha256 of the raw bytes
+    batch_id: Optional[str] = None # Set for files uploaded through /files/upload-batch
+    previous_gridfs_id: Optional[str] = None # Version being replaced; deleted once the update is ingested
     status: str = "pending"
+    # Ingestion progress, published by the worker: queued, downloading, parsing, reusing, embedding, completed, failed
+    stage: str = "queued"
+    chunks_total: Optional[int] = None
+    chunks_embedded: int = 0
     error_message: Optional[str] = None
     created_at: datetime = Field(default_factory=datetime.now)
+    updated_at: datetime = Field(default_factory=datetime.now)
     
     class Settings:
         name = "files"
+        indexes = [
+            IndexModel([("user_corpus", ASCENDING), ("content_hash", ASCENDING)]),
+            IndexModel([("batch_id", ASCENDING)], sparse=True),
+            IndexModel([("user_email", ASCENDING), ("_id", DESCENDING)]), # /files/list pages
+            IndexModel([("user_email", ASCENDING), ("updated_at", ASCENDING)]), # Progress polling
+            IndexModel([("status", ASCENDING), ("updated_at", ASCENDING)]), # Local index re-sync polling
+        ]
+
+class FileSummary(BaseModel):
+    """Projection for /files/list."""
+    id: PydanticObjectId = Field(alias="_id")
+    filename: str
+    file_size: int
+    content_type: str
+    status: str
+    stage: Optional[str] = None
+    chunks_total: Optional[int] = None
+    chunks_embedded: int = 0
+    error_message: Optional[str] = None
+    batch_id: Optional[str] = None
+    created_at: datetime
+    updated_at: Optional[datetime] = None
 
 class Chunk(Document):
     document_id: str # Ref to FileMetadata
@@ -23,9 +58,36 @@ class Chunk(Document):
     user_email: str
     chunk_index: int
     content: str
-    embedding: List[float] # Voyage-3 (1024 dims)
+    content_hash: Optional[str] = None # sha256 of content
+    embedding: Embedding # Voyage-3 (1024 dims)
+    embedding_model: Optional[str] = None # VOYAGE_MODEL that produced the embedding
+    embedding_quantized: Optional[InstanceOf[Binary]] = None # int8 / packed-bit BinData when VECTOR_QUANTIZATION is set
     metadata: Dict[str, Any] = Field(default_factory=dict)
     created_at: datetime = Field(default_factory=datetime.now)
     
     class Settings:
         name = "chunks"
+        indexes = [
+            IndexModel([("user_corpus", ASCENDING), ("content_hash", ASCENDING), ("embedding_model", ASCENDING)]),
+            IndexModel([("document_id", ASCENDING), ("chunk_index", ASCENDING)]),
+        ]
+
+class ChunkEmbedding(BaseModel):
+    """Projection used when reusing stored embeddings."""
+    content_hash: str
+    embedding: Embedding
+
+class ChunkRef(BaseModel):
+    """Projection used to diff a document's stored chunks against a new version."""
+    id: PydanticObjectId = Field(alias="_id")
+    chunk_index: int
+    content_hash: Optional[str] = None
+
+class ChunkSummary(BaseModel):
+    """Projection for listings and exports; never loads the embedding."""
+    id: PydanticObjectId = Field(alias="_id")
+    document_id: str
+    chunk_index: int
+    content: str
+    metadata: Dict[str, Any] = Field(default_factory=dict)
+    created_at: datetime
@@ -0,0 +1,136 @@
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from pymongo import ReturnDocument
+
+from src.db.mongo import db
+from src.config import get_settings
+from src.services.cache import TTLCache
+from src.services.metrics import CACHE_LOOKUPS
+
+class CorpusVersions:
+    """
+    Per-corpus version counters in Mongo. Bumped whenever a file finishes ingesting or
+    is deleted, so every process can tell when cached answers for a corpus went stale.
+    """
+    collection_name = "corpus_versions"
+
+    def _collection(self):
+        return db.client[get_settings().MONGODB_DATABASE][self.collection_name]
+
+    async def get(self, user_corpus: str) -> int:
+        doc = await self._collection().find_one({"_id": user_corpus})
+        return doc["version"] if doc else 0
+
+    async def bump(self, user_corpus: str) -> int:
+        doc = await self._collection().find_one_and_update(
+            {"_id": user_corpus},
+            {"$inc": {"version": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return doc["version"]
+
+corpus_versions = CorpusVersions()
+
+@dataclass
+class CachedAnswer:
+    query: str
+    answer: str
+    sources: List[dict]
+    version: int
+    latency: float # Seconds the original request took; what a hit saves
+    created_at: float
+
+class _Bucket:
+    """Cached answers of one (user_corpus, rag_strategy), searched by query similarity."""
+    def __init__(self, dim: int):
+        self.vectors = np.empty((0, dim), dtype=np.float32)
+        self.entries: List[CachedAnswer] = []
+
+    def drop(self, keep: np.ndarray):
+        self.vectors = self.vectors[keep]
+        self.entries = [e for e, k in zip(self.entries, keep) if k]
+
+class AnswerCache:
+    """
+    Semantic cache of /chat/query responses. A new query reuses a stored answer when its
+    embedding is within SEMANTIC_CACHE_THRESHOLD cosine similarity of a previous query
+    from the same user_corpus and rag_strategy, and the corpus version hasn't changed.
+    """
+    def __init__(self):
+        self._buckets: Optional[TTLCache] = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.latency_saved = 0.0
+
+    @property
+    def buckets(self) -> TTLCache:
+        if self._buckets is None:
+            settings = get_settings()
+            self._buckets = TTLCache(maxsize=settings.SEMANTIC_CACHE_MAX_CORPORA, ttl=settings.SEMANTIC_CACHE_TTL_SECONDS)
+        return self._buckets
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, user_corpus: str, strategy: str, embedding: List[float], version: int) -> Optional[CachedAnswer]:
+        settings = get_settings()
+        with self._lock:
+            bucket = self.buckets.get((user_corpus, strategy))
+            if bucket is not None and bucket.entries:
+                # Entries from older corpus versions or past their TTL are dead
+                now = time.time()
+                live = np.array([e.version == version and now - e.created_at < settings.SEMANTIC_CACHE_TTL_SECONDS for e in bucket.entries])
+                if not live.all():
+                    bucket.drop(live)
+
+                if bucket.entries:
+                    scores = bucket.vectors @ self._normalize(embedding)
+                    best = int(np.argmax(scores))
+                    if scores[best] >= settings.SEMANTIC_CACHE_THRESHOLD:
+                        entry = bucket.entries[best]
+                        self.hits += 1
+                        self.latency_saved += entry.latency
+                        CACHE_LOOKUPS.labels(cache="answer", result="hit").inc()
+                        return entry
+
+            self.misses += 1
+            CACHE_LOOKUPS.labels(cache="answer", result="miss").inc()
+            return None
+
+    def store(self, user_corpus: str, strategy: str, embedding: List[float], entry: CachedAnswer):
+        settings = get_settings()
+        vector = self._normalize(embedding)
+        with self._lock:
+            key = (user_corpus, strategy)
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = _Bucket(dim=len(vector))
+            bucket.vectors = np.vstack([bucket.vectors, vector[np.newaxis, :]])
+            bucket.entries.append(entry)
+
+            overflow = len(bucket.entries) - settings.SEMANTIC_CACHE_MAX_ENTRIES
+            if overflow > 0:
+                keep = np.ones(len(bucket.entries), dtype=bool)
+                keep[:overflow] = False # Oldest first
+                bucket.drop(keep)
+            self.buckets.set(key, bucket)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "latency_saved_seconds": self.latency_saved,
+        }
+
+answer_cache = AnswerCache()
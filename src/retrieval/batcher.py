@@ -0,0 +1,92 @@
+import asyncio
+import logging
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+from src.config import get_settings
+from src.services.metrics import EMBED_BATCH_SIZE, EMBED_BATCH_WAIT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+class EmbeddingBatcher:
+    """
+    Coalesces embedding requests from concurrent coroutines into single Voyage calls.
+
+    Requests are collected for EMBED_BATCH_WINDOW_MS (or until EMBED_BATCH_MAX_SIZE are
+    pending), duplicates are embedded once, and every caller receives its own vector.
+    """
+    def __init__(self, embed_fn: Callable[[List[str]], List[List[float]]]):
+        self.embed_fn = embed_fn # Sync; runs in a worker thread
+        self._pending: List[Tuple[str, asyncio.Future, float]] = []
+        self._timer: asyncio.TimerHandle = None
+        self._inflight: set = set()
+
+        self.batches = 0
+        self.items = 0
+        self.max_batch_size = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    async def embed(self, text: str) -> List[float]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future, time.monotonic()))
+
+        settings = get_settings()
+        if len(self._pending) >= settings.EMBED_BATCH_MAX_SIZE:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(settings.EMBED_BATCH_WINDOW_MS / 1000, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending = self._pending, []
+        batch = [item for item in batch if not item[1].done()] # Drop cancelled callers
+        if not batch:
+            return
+
+        now = time.monotonic()
+        waits = [now - enqueued_at for _, _, enqueued_at in batch]
+        self.batches += 1
+        self.items += len(batch)
+        self.max_batch_size = max(self.max_batch_size, len(batch))
+        self.total_wait += sum(waits)
+        self.max_wait = max(self.max_wait, max(waits))
+        EMBED_BATCH_SIZE.observe(len(batch))
+        for wait in waits:
+            EMBED_BATCH_WAIT_SECONDS.observe(wait)
+
+        task = asyncio.create_task(self._run(batch))
+        self._inflight.add(task)
+        task.add_done_callback(self._inflight.discard)
+
+    async def _run(self, batch: List[Tuple[str, asyncio.Future, float]]):
+        texts = list(dict.fromkeys(text for text, _, _ in batch))
+        logger.debug(f"Embedding batch of {len(texts)} unique texts for {len(batch)} callers")
+        try:
+            embeddings = await asyncio.to_thread(self.embed_fn, texts)
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        by_text = dict(zip(texts, embeddings))
+        for text, future, _ in batch:
+            if not future.done():
+                future.set_result(by_text[text])
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": self.items / self.batches if self.batches else 0.0,
+            "max_batch_size": self.max_batch_size,
+            "avg_wait_ms": 1000 * self.total_wait / self.items if self.items else 0.0,
+            "max_wait_ms": 1000 * self.max_wait,
+        }
@@ -0,0 +1,177 @@
+import heapq
+import math
+import re
+from array import array
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional
+
+TOKEN_RE = re.compile(r"\w+")
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_RE.findall(text.lower())
+
+class CorpusBM25:
+    """
+    Inverted index over the chunks of a single user_corpus.
+    Postings are parallel arrays of (slot, term frequency); document lengths are
+    precomputed per slot. Removed chunks are tombstoned and compacted lazily.
+    """
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, tuple] = {} # term -> (array of slots, array of tfs)
+        self.doc_len = array("I")
+        self.alive = bytearray()
+        self.payloads: List[Optional[Dict[str, Any]]] = []
+        self.slots: Dict[str, int] = {}
+        self.live = 0
+        self.total_len = 0
+
+    def add(self, chunk_id: str, payload: Dict[str, Any], text: str):
+        if chunk_id in self.slots:
+            return
+        terms = Counter(tokenize(text))
+        length = sum(terms.values())
+
+        slot = len(self.doc_len)
+        self.doc_len.append(length)
+        self.alive.append(1)
+        self.payloads.append(payload)
+        self.slots[chunk_id] = slot
+        self.live += 1
+        self.total_len += length
+
+        for term, tf in terms.items():
+            postings = self.postings.get(term)
+            if postings is None:
+                postings = self.postings[term] = (array("I"), array("I"))
+            postings[0].append(slot)
+            postings[1].append(tf)
+
+    def remove(self, chunk_id: str) -> bool:
+        slot = self.slots.pop(chunk_id, None)
+        if slot is None:
+            return False
+        self.alive[slot] = 0
+        self.payloads[slot] = None
+        self.live -= 1
+        self.total_len -= self.doc_len[slot]
+        if len(self.doc_len) > 1024 and self.live < len(self.doc_len) // 2:
+            self._compact()
+        return True
+
+    def _compact(self):
+        remap = {}
+        doc_len, payloads = array("I"), []
+        for slot, is_alive in enumerate(self.alive):
+            if is_alive:
+                remap[slot] = len(doc_len)
+                doc_len.append(self.doc_len[slot])
+                payloads.append(self.payloads[slot])
+
+        postings = {}
+        for term, (slots, tfs) in self.postings.items():
+            new_slots, new_tfs = array("I"), array("I")
+            for slot, tf in zip(slots, tfs):
+                if slot in remap:
+                    new_slots.append(remap[slot])
+                    new_tfs.append(tf)
+            if new_slots:
+                postings[term] = (new_slots, new_tfs)
+
+        self.postings = postings
+        self.doc_len = doc_len
+        self.payloads = payloads
+        self.alive = bytearray(b"\x01" * len(doc_len))
+        self.slots = {p["_id"]: i for i, p in enumerate(payloads)}
+
+    def search(self, query: str, limit: int) -> List[tuple]:
+        """Returns (score, payload) pairs, best first."""
+        if not self.live:
+            return []
+        avg_len = self.total_len / self.live or 1.0
+        k1, b = self.k1, self.b
+
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if postings is None:
+                continue
+            matches = [(slot, tf) for slot, tf in zip(*postings) if self.alive[slot]]
+            if not matches:
+                continue
+            df = len(matches)
+            idf = math.log(1 + (self.live - df + 0.5) / (df + 0.5))
+            for slot, tf in matches:
+                norm = k1 * (1 - b + b * self.doc_len[slot] / avg_len)
+                scores[slot] = scores.get(slot, 0.0) + idf * tf * (k1 + 1) / (tf + norm)
+
+        top = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+        return [(score, self.payloads[slot]) for slot, score in top]
+
+
+class KeywordIndex:
+    """In-process BM25 index partitioned by user_corpus."""
+    def __init__(self):
+        self.corpora: Dict[str, CorpusBM25] = {}
+        self.chunk_corpus: Dict[str, str] = {}
+
+    def add_chunks(self, docs: Iterable[Dict[str, Any]]):
+        for doc in docs:
+            corpus = doc["user_corpus"]
+            index = self.corpora.get(corpus)
+            if index is None:
+                index = self.corpora[corpus] = CorpusBM25()
+
+            chunk_id = str(doc["_id"])
+            index.add(chunk_id, {
+                "_id": chunk_id,
+                "document_id": doc["document_id"],
+                "chunk_index": doc.get("chunk_index"),
+                "content": doc["content"],
+                "metadata": doc.get("metadata", {}),
+            }, doc["content"])
+            self.chunk_corpus[chunk_id] = corpus
+
+    def remove_chunks(self, chunk_ids: Iterable[str]):
+        for chunk_id in chunk_ids:
+            corpus = self.chunk_corpus.pop(chunk_id, None)
+            if corpus is not None:
+                self.corpora[corpus].remove(chunk_id)
+
+    def update_chunks(self, docs: Iterable[Dict[str, Any]]):
+        for doc in docs:
+            chunk_id = str(doc["_id"])
+            corpus = self.chunk_corpus.get(chunk_id)
+            if corpus is not None:
+                index = self.corpora[corpus]
+                slot = index.slots[chunk_id]
+                # Replaced rather than mutated: search results may still hold the old payload
+                index.payloads[slot] = {**index.payloads[slot], "chunk_index": doc["chunk_index"]}
+
+    def document_chunks(self, user_corpus: str, document_id: str) -> Dict[str, Optional[int]]:
+        index = self.corpora.get(user_corpus)
+        if index is None:
+            return {}
+        return {
+            cid: index.payloads[slot]["chunk_index"]
+            for cid, slot in index.slots.items() if index.payloads[slot]["document_id"] == document_id
+        }
+
+    def remove_document(self, user_corpus: str, document_id: str):
+        self.remove_chunks(list(self.document_chunks(user_corpus, document_id)))
+
+    def search(self, query: str, user_corpus: Optional[str], limit: int = 20) -> List[Dict[str, Any]]:
+        if user_corpus:
+            index = self.corpora.get(user_corpus)
+            hits = index.search(query, limit) if index else []
+        else:
+            # Per-corpus statistics, so scores are only roughly comparable across tenants
+            hits = heapq.nlargest(
+                limit,
+                (hit for index in self.corpora.values() for hit in index.search(query, limit)),
+                key=lambda hit: hit[0],
+            )
+        return [{**payload, "score": score} for score, payload in hits]
+
+keyword_index = KeywordIndex()
@@ -0,0 +1,131 @@
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from src.config import get_settings
+from src.retrieval.service import SearchResult
+
+# Rough prompt-token estimate (same ratio as rerank truncation)
+CHARS_PER_TOKEN = 4
+
+# Shorter suffix/prefix matches between neighbors are treated as coincidence, not chunk overlap
+MIN_OVERLAP_CHARS = 20
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+@dataclass
+class Passage:
+    """One contiguous span of a document in the prompt: one or more adjacent chunks, overlaps removed."""
+    document_id: str
+    content: str
+    score: float # Best score of its chunks
+    chunk_ids: List[str] = field(default_factory=list)
+    chunk_indexes: List[Optional[int]] = field(default_factory=list)
+    metadata: Dict[str, Any] = field(default_factory=dict)
+
+def _common_leading_lines(a: str, b: str) -> int:
+    """Characters of `b` taken up by leading lines it shares with `a` (the heading path of contextualized chunks)."""
+    a_lines, b_lines = a.split("\n"), b.split("\n")
+    shared = 0
+    for a_line, b_line in zip(a_lines[:-1], b_lines[:-1]):
+        if a_line != b_line:
+            break
+        shared += len(b_line) + 1
+    return shared
+
+def _overlap(a: str, b: str) -> int:
+    """Length of the longest suffix of `a` that is also a prefix of `b`."""
+    probe = b[:MIN_OVERLAP_CHARS]
+    if len(probe) < MIN_OVERLAP_CHARS:
+        return 0
+    pos = a.find(probe, max(0, len(a) - len(b)))
+    while pos != -1:
+        if b.startswith(a[pos:]):
+            return len(a) - pos
+        pos = a.find(probe, pos + 1)
+    return 0
+
+def _join(passage: str, previous: str, text: str) -> str:
+    """Append chunk `text` to a passage ending in its neighbor `previous`, without repeated headings or overlap."""
+    text = text[_common_leading_lines(previous, text):]
+    overlap = _overlap(previous, text)
+    if overlap:
+        # Picks up exactly where the previous chunk stopped, possibly mid-word
+        return passage + text[overlap:]
+    text = text.strip()
+    return f"{passage}\n{text}" if text else passage
+
+class ContextPacker:
+    """
+    Turns ranked search results into prompt context. Chunks are taken best score first
+    until CONTEXT_MAX_TOKENS is used up; adjacent chunks (by chunk_index) of the same
+    document are merged into one passage with their overlapping text and repeated
+    headings removed, and repeated chunk texts are only included once.
+    """
+    def __init__(self, max_tokens: Optional[int] = None):
+        self._max_tokens = max_tokens
+
+    @property
+    def max_tokens(self) -> int:
+        return self._max_tokens or get_settings().CONTEXT_MAX_TOKENS
+
+    def pack(self, results: List[SearchResult]) -> List[Passage]:
+        max_tokens = self.max_tokens
+        selected: Dict[str, List[SearchResult]] = defaultdict(list) # document_id -> chunks
+        doc_tokens: Dict[str, int] = defaultdict(int)
+        seen = set()
+        total = 0
+
+        for result in sorted(results, key=lambda r: r.similarity, reverse=True):
+            text = " ".join(result.content.split())
+            if not text or text in seen:
+                continue # Same text from another document (e.g. a re-uploaded copy)
+
+            candidate = selected[result.document_id] + [result]
+            tokens = sum(estimate_tokens(p.content) for p in self._passages(candidate))
+            if total - doc_tokens[result.document_id] + tokens > max_tokens:
+                if total == 0:
+                    # Never send an empty context: the best chunk alone, cut to the budget
+                    result = result.model_copy(update={"content": result.content[:max_tokens * CHARS_PER_TOKEN]})
+                    selected[result.document_id] = [result]
+                    doc_tokens[result.document_id] = total = max_tokens
+                continue
+
+            seen.add(text)
+            selected[result.document_id] = candidate
+            total += tokens - doc_tokens[result.document_id]
+            doc_tokens[result.document_id] = tokens
+
+        passages = [p for chunks in selected.values() for p in self._passages(chunks)]
+        return sorted(passages, key=lambda p: p.score, reverse=True)
+
+    @staticmethod
+    def _passages(chunks: List[SearchResult]) -> List[Passage]:
+        """Merge chunks of one document into passages of consecutive chunk_index."""
+        passages: List[Passage] = []
+        previous: Optional[SearchResult] = None
+        for chunk in sorted(chunks, key=lambda c: (c.chunk_index is None, c.chunk_index or 0)):
+            adjacent = (
+                previous is not None and chunk.chunk_index is not None
+                and previous.chunk_index is not None and chunk.chunk_index == previous.chunk_index + 1
+            )
+            if adjacent:
+                passage = passages[-1]
+                passage.content = _join(passage.content, previous.content, chunk.content)
+                passage.score = max(passage.score, chunk.similarity)
+                passage.chunk_ids.append(chunk.chunk_id)
+                passage.chunk_indexes.append(chunk.chunk_index)
+            else:
+                passages.append(Passage(
+                    document_id=chunk.document_id,
+                    content=chunk.content,
+                    score=chunk.similarity,
+                    chunk_ids=[chunk.chunk_id],
+                    chunk_indexes=[chunk.chunk_index],
+                    metadata=chunk.metadata,
+                ))
+            previous = chunk
+        return passages
+
+context_packer = ContextPacker()
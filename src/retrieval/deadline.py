@@ -0,0 +1,74 @@
+import asyncio
+import logging
+import time
+from contextvars import ContextVar
+from typing import Awaitable, List, Optional, TypeVar
+
+from src.config import get_settings
+from src.services.metrics import DEGRADED_STAGES
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+_current: ContextVar[Optional["Deadline"]] = ContextVar("search_deadline", default=None)
+
+class Deadline:
+    """
+    Latency budget of one search request, carried through the pipeline in a contextvar.
+    Optional stages get min(their own budget, time left) and fall back to a fixed
+    degraded result when they run out, instead of stalling the request.
+    """
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+        self.degraded: List[str] = []
+
+    @classmethod
+    def start(cls, seconds: Optional[float] = None) -> Optional["Deadline"]:
+        """Attach a new deadline to the current context. Returns None when deadlines are disabled."""
+        if seconds is None:
+            seconds = get_settings().SEARCH_DEADLINE_SECONDS
+        deadline = cls(seconds) if seconds > 0 else None
+        _current.set(deadline)
+        return deadline
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def budget(self, stage_seconds: float) -> float:
+        return min(stage_seconds, self.remaining())
+
+    def degrade(self, stage: str):
+        if stage not in self.degraded:
+            self.degraded.append(stage)
+        DEGRADED_STAGES.labels(stage=stage).inc()
+        logger.info(f"Search stage '{stage}' out of budget; degraded ({self.remaining():.2f}s left)")
+
+def current_deadline() -> Optional[Deadline]:
+    return _current.get()
+
+def degraded_stages() -> List[str]:
+    deadline = _current.get()
+    return list(deadline.degraded) if deadline else []
+
+async def within_budget(stage: str, stage_seconds: float, awaitable: Awaitable[T], fallback: T, cancel_late: bool = False) -> T:
+    """
+    Await `awaitable` within the stage budget of the current deadline, returning `fallback`
+    on timeout. Unless `cancel_late`, the work keeps running in the background so that
+    whatever it caches is there for the next request.
+    """
+    deadline = current_deadline()
+    if deadline is None:
+        return await awaitable
+
+    task = asyncio.ensure_future(awaitable)
+    try:
+        return await asyncio.wait_for(asyncio.shield(task), deadline.budget(stage_seconds))
+    except asyncio.TimeoutError:
+        deadline.degrade(stage)
+        if cancel_late:
+            task.cancel()
+        # Retrieve a late failure so it isn't reported as never retrieved
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return fallback
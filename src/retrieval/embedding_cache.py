@@ -0,0 +1,110 @@
+import hashlib
+import logging
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+
+from pymongo.errors import OperationFailure
+
+from src.db.mongo import db
+from src.config import get_settings
+from src.services.cache import TTLCache
+from src.services.metrics import CACHE_LOOKUPS
+from src.services.vectors import decode_embedding, pack_float32
+
+logger = logging.getLogger(__name__)
+
+class EmbeddingCache:
+    """
+    Query-embedding cache keyed by (model, input_type, normalized text).
+    Entries live in a per-process LRU/TTL cache and, when EMBEDDING_CACHE_SHARED
+    is set, in a Mongo collection so every uvicorn worker shares them.
+    """
+    collection_name = "embedding_cache"
+
+    def __init__(self):
+        self._local: Optional[TTLCache] = None
+        self.shared_hits = 0
+
+    @property
+    def local(self) -> TTLCache:
+        # Built lazily so importing this module doesn't require settings to be loadable
+        if self._local is None:
+            settings = get_settings()
+            self._local = TTLCache(maxsize=settings.EMBEDDING_CACHE_SIZE, ttl=settings.EMBEDDING_CACHE_TTL_SECONDS)
+        return self._local
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return " ".join(text.split())
+
+    @classmethod
+    def make_key(cls, text: str, input_type: str = "query", model: Optional[str] = None) -> Tuple[str, str, str]:
+        return (model or get_settings().VOYAGE_MODEL, input_type, cls.normalize(text))
+
+    def _collection(self):
+        return db.client[get_settings().MONGODB_DATABASE][self.collection_name]
+
+    async def ensure_index(self):
+        """TTL index on created_at, created once at startup. A changed TTL is applied with collMod."""
+        ttl = int(get_settings().EMBEDDING_CACHE_TTL_SECONDS)
+        try:
+            await self._collection().create_index("created_at", expireAfterSeconds=ttl)
+        except OperationFailure as e:
+            if e.code != 85: # IndexOptionsConflict: the index exists with the previous TTL
+                logger.warning(f"Shared embedding cache index creation failed: {e}")
+                return
+            try:
+                await self._collection().database.command(
+                    "collMod", self.collection_name, index={"keyPattern": {"created_at": 1}, "expireAfterSeconds": ttl}
+                )
+            except Exception as e:
+                logger.warning(f"Shared embedding cache TTL update failed: {e}")
+        except Exception as e:
+            logger.warning(f"Shared embedding cache index creation failed: {e}")
+
+    @staticmethod
+    def _shared_id(key: Tuple[str, str, str]) -> str:
+        return hashlib.sha256("\x00".join(key).encode("utf-8")).hexdigest()
+
+    async def get(self, key: Tuple[str, str, str]) -> Optional[List[float]]:
+        embedding = self.local.get(key)
+        if embedding is not None:
+            CACHE_LOOKUPS.labels(cache="embedding", result="hit").inc()
+            return embedding
+        if not get_settings().EMBEDDING_CACHE_SHARED:
+            CACHE_LOOKUPS.labels(cache="embedding", result="miss").inc()
+            return None
+
+        try:
+            doc = await self._collection().find_one({"_id": self._shared_id(key)}, {"embedding": 1})
+        except Exception as e:
+            logger.warning(f"Shared embedding cache lookup failed: {e}")
+            doc = None
+
+        if doc:
+            self.shared_hits += 1
+            CACHE_LOOKUPS.labels(cache="embedding", result="shared_hit").inc()
+            embedding = decode_embedding(doc["embedding"]).tolist()
+            self.local.set(key, embedding)
+            return embedding
+        CACHE_LOOKUPS.labels(cache="embedding", result="miss").inc()
+        return None
+
+    async def set(self, key: Tuple[str, str, str], embedding: List[float]):
+        self.local.set(key, embedding)
+        if not get_settings().EMBEDDING_CACHE_SHARED:
+            return
+
+        try:
+            await self._collection().replace_one(
+                {"_id": self._shared_id(key)},
+                {"embedding": pack_float32(embedding), "created_at": datetime.now(timezone.utc)},
+                upsert=True,
+            )
+        except Exception as e:
+            logger.warning(f"Shared embedding cache write failed: {e}")
+
+    def stats(self) -> dict:
+        return {**self.local.stats(), "shared_hits": self.shared_hits}
+
+embedding_cache = EmbeddingCache()
@@ -0,0 +1,228 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional
+
+from bson import ObjectId
+from pymongo.errors import OperationFailure
+
+from src.db.mongo import db
+from src.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+class ChunkIndexSync:
+    """
+    Keeps in-process chunk indexes in step with the `chunks` collection.
+
+    Registered indexes are bulk-loaded at startup and then updated from a change stream
+    (inserts, deletes and chunk_index updates). On a standalone MongoDB (no change streams)
+    new chunks are picked up by polling instead, and every document whose file finished
+    (re-)ingesting since the last poll is re-synced, so chunks dropped or moved by a PUT
+    reach this process too. Whole-file deletions are only applied when made through this process.
+    Subscribed listeners (e.g. caches) only receive changes, never the bulk load.
+    Each index or listener must provide add_chunks(docs), update_chunks(docs) (new chunk_index
+    of already indexed chunks), remove_chunks(chunk_ids) and remove_document(user_corpus, document_id);
+    indexes also document_chunks(user_corpus, document_id) -> {chunk_id: chunk_index}.
+    """
+    projection = {"_id": 1, "document_id": 1, "user_corpus": 1, "chunk_index": 1, "content": 1, "metadata": 1, "embedding": 1}
+    load_batch_size = 1000
+    poll_lookback = timedelta(seconds=60)
+
+    def __init__(self):
+        self.indexes: List[Any] = []
+        self.listeners: List[Any] = []
+        self.loaded = False
+        self._task: asyncio.Task = None
+        self._last_id: ObjectId = None
+        self._recent_ids: set = set() # Ids inside the polling look-back window
+        self._last_file_update: Optional[datetime] = None
+        self._recent_files: set = set() # (file id, updated_at) re-synced inside the look-back window
+
+    def register(self, index: Any):
+        if index not in self.indexes:
+            self.indexes.append(index)
+
+    def subscribe(self, listener: Any):
+        if listener not in self.listeners:
+            self.listeners.append(listener)
+
+    @property
+    def targets(self) -> List[Any]:
+        return self.indexes + self.listeners
+
+    def _collection(self):
+        return db.client[get_settings().MONGODB_DATABASE]["chunks"]
+
+    def _files(self):
+        return db.client[get_settings().MONGODB_DATABASE]["files"]
+
+    async def start(self):
+        if not self.targets:
+            return
+
+        if self.indexes:
+            # Files finishing after this point are re-synced by the first poll (standalone MongoDB only)
+            latest = await self._files().find_one({}, {"updated_at": 1}, sort=[("updated_at", -1)])
+            self._last_file_update = latest.get("updated_at") if latest else None
+
+            count = 0
+            batch = []
+            async for doc in self._collection().find({}, self.projection).sort("_id", 1):
+                batch.append(doc)
+                if len(batch) >= self.load_batch_size:
+                    count += self._apply_inserts(batch, bulk_load=True)
+                    batch = []
+            count += self._apply_inserts(batch, bulk_load=True)
+            logger.info(f"Loaded {count} chunks into {len(self.indexes)} in-process index(es)")
+
+        self.loaded = True
+        self._task = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _apply_inserts(self, docs: List[Dict[str, Any]], bulk_load: bool = False) -> int:
+        if not docs:
+            return 0
+        for target in (self.indexes if bulk_load else self.targets):
+            target.add_chunks(docs)
+        newest = max(doc["_id"] for doc in docs)
+        if self._last_id is None or newest > self._last_id:
+            self._last_id = newest
+        return len(docs)
+
+    def _apply_updates(self, docs: List[Dict[str, Any]]):
+        for target in self.targets:
+            target.update_chunks(docs)
+
+    # Hooks for writers in this process; no-ops until the indexes are loaded
+
+    def add_chunks(self, docs: Iterable[Dict[str, Any]]):
+        if self.loaded:
+            self._apply_inserts(list(docs))
+
+    def update_chunks(self, docs: Iterable[Dict[str, Any]]):
+        """docs: {"_id", "chunk_index"} of chunks that moved within their document."""
+        if self.loaded:
+            self._apply_updates(list(docs))
+
+    def remove_chunks(self, chunk_ids: Iterable[str]):
+        if self.loaded:
+            chunk_ids = list(chunk_ids)
+            for target in self.targets:
+                target.remove_chunks(chunk_ids)
+
+    def remove_document(self, user_corpus: str, document_id: str):
+        if self.loaded:
+            for target in self.targets:
+                target.remove_document(user_corpus, document_id)
+
+    async def _watch(self):
+        pipeline = [{"$match": {"$or": [
+            {"operationType": {"$in": ["insert", "delete"]}},
+            # Chunks kept by a PUT but moved; other updates (e.g. quantization backfills) don't matter here
+            {"operationType": "update", "updateDescription.updatedFields.chunk_index": {"$exists": True}},
+        ]}}]
+        if not self.indexes:
+            # Listeners never need vectors; keep them off the wire
+            pipeline.append({"$project": {"fullDocument.embedding": 0}})
+        while True:
+            try:
+                async with self._collection().watch(pipeline) as stream:
+                    logger.info("Watching chunks change stream")
+                    async for change in stream:
+                        if change["operationType"] == "insert":
+                            doc = change["fullDocument"]
+                            self._apply_inserts([{k: doc[k] for k in self.projection if k in doc}])
+                        elif change["operationType"] == "update":
+                            chunk_index = change["updateDescription"]["updatedFields"]["chunk_index"]
+                            self._apply_updates([{"_id": change["documentKey"]["_id"], "chunk_index": chunk_index}])
+                        else:
+                            self.remove_chunks([str(change["documentKey"]["_id"])])
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                if not self.indexes:
+                    logger.info(f"Change streams unavailable ({e}); only local changes reach chunk listeners")
+                    return
+                logger.info(f"Change streams unavailable ({e}); polling for chunk changes instead")
+                await self._poll()
+                return
+            except Exception as e:
+                logger.warning(f"Chunk change stream interrupted: {e}; reconnecting")
+                await asyncio.sleep(1)
+
+    async def _poll(self):
+        interval = get_settings().LOCAL_INDEX_POLL_SECONDS
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self._poll_inserts()
+                await self._poll_files()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Polling chunks failed: {e}")
+
+    async def _poll_inserts(self):
+        # ObjectIds are generated on the writers' clocks, so look back a little; adds are idempotent
+        query = {}
+        if self._last_id is not None:
+            since = ObjectId.from_datetime(self._last_id.generation_time - self.poll_lookback)
+            self._recent_ids = {oid for oid in self._recent_ids if oid > since}
+            query = {"_id": {"$gt": since}}
+        ids = [doc["_id"] async for doc in self._collection().find(query, {"_id": 1})]
+        new_ids = [oid for oid in ids if oid not in self._recent_ids]
+        if new_ids:
+            docs = await self._collection().find({"_id": {"$in": new_ids}}, self.projection).to_list(length=None)
+            self._apply_inserts(docs)
+            self._recent_ids.update(doc["_id"] for doc in docs)
+
+    async def _poll_files(self):
+        """Re-sync documents whose file completed since the last poll; updated_at is on the writers' clocks too."""
+        query: Dict[str, Any] = {"status": "completed"}
+        if self._last_file_update is not None:
+            since = self._last_file_update - self.poll_lookback
+            self._recent_files = {(file_id, updated) for file_id, updated in self._recent_files if updated > since}
+            query["updated_at"] = {"$gt": since}
+        files = await self._files().find(query, {"user_corpus": 1, "updated_at": 1}).to_list(length=None)
+        for file in files:
+            if (file["_id"], file["updated_at"]) in self._recent_files:
+                continue
+            await self._resync_document(file["user_corpus"], str(file["_id"]))
+            self._recent_files.add((file["_id"], file["updated_at"]))
+        if files:
+            newest = max(file["updated_at"] for file in files)
+            if self._last_file_update is None or newest > self._last_file_update:
+                self._last_file_update = newest
+
+    async def _resync_document(self, user_corpus: str, document_id: str):
+        """Drop indexed chunks of the document that are gone from `chunks` and apply moved chunk_index values."""
+        # Snapshot first, so a chunk indexed while the query runs can't be mistaken for a deleted one
+        indexed: Dict[str, Optional[int]] = {}
+        for index in self.indexes:
+            indexed.update(index.document_chunks(user_corpus, document_id))
+        if not indexed:
+            return
+        stored = {
+            str(doc["_id"]): doc.get("chunk_index")
+            async for doc in self._collection().find({"document_id": document_id}, {"chunk_index": 1})
+        }
+        removed = [chunk_id for chunk_id in indexed if chunk_id not in stored]
+        moved = [
+            {"_id": chunk_id, "chunk_index": stored[chunk_id]}
+            for chunk_id, chunk_index in indexed.items() if chunk_id in stored and stored[chunk_id] != chunk_index
+        ]
+        if removed:
+            self.remove_chunks(removed)
+        if moved:
+            self._apply_updates(moved)
+
+index_sync = ChunkIndexSync()
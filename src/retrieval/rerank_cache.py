@@ -0,0 +1,80 @@
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from src.config import get_settings
+from src.services.cache import TTLCache
+from src.services.metrics import CACHE_LOOKUPS
+
+class RerankCache:
+    """
+    Rerank outcomes keyed by (normalized query, rerank model, ordered candidate chunk_ids, top_k).
+    Entries are dropped as soon as any of their chunks, or any chunk of one of their
+    documents, is deleted or (re-)ingested. Subscribed to ChunkIndexSync for those events.
+    """
+    def __init__(self):
+        self._cache: Optional[TTLCache] = None
+        self._by_chunk: Dict[str, Set[tuple]] = {}
+        self._by_document: Dict[str, Set[tuple]] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self) -> TTLCache:
+        if self._cache is None:
+            settings = get_settings()
+            self._cache = TTLCache(maxsize=settings.RERANK_CACHE_SIZE, ttl=settings.RERANK_CACHE_TTL_SECONDS)
+        return self._cache
+
+    @staticmethod
+    def make_key(query: str, chunk_ids: List[str], top_k: int) -> tuple:
+        return (" ".join(query.split()), get_settings().VOYAGE_RERANK_MODEL, tuple(chunk_ids), top_k)
+
+    def get(self, key: tuple) -> Optional[List[Tuple[int, float]]]:
+        """Returns (candidate index, relevance score) pairs in reranked order."""
+        ranking = self.cache.get(key)
+        CACHE_LOOKUPS.labels(cache="rerank", result="miss" if ranking is None else "hit").inc()
+        return ranking
+
+    def set(self, key: tuple, ranking: List[Tuple[int, float]], document_ids: Iterable[str]):
+        self.cache.set(key, ranking)
+        with self._lock:
+            for chunk_id in key[2]:
+                self._by_chunk.setdefault(chunk_id, set()).add(key)
+            for document_id in set(document_ids):
+                self._by_document.setdefault(document_id, set()).add(key)
+            # Keys evicted by the LRU linger in the reverse maps; prune them now and then
+            if len(self._by_chunk) > 100 * max(self.cache.maxsize, 1):
+                self._prune()
+
+    def _prune(self):
+        for reverse in (self._by_chunk, self._by_document):
+            for ref in list(reverse):
+                live = {key for key in reverse[ref] if key in self.cache}
+                if live:
+                    reverse[ref] = live
+                else:
+                    del reverse[ref]
+
+    def _evict(self, reverse: Dict[str, Set[tuple]], refs: Iterable[str]):
+        with self._lock:
+            for ref in refs:
+                for key in reverse.pop(ref, ()):
+                    self.cache.delete(key)
+
+    # ChunkIndexSync listener interface
+
+    def add_chunks(self, docs: Iterable[Dict[str, Any]]):
+        self._evict(self._by_document, {doc["document_id"] for doc in docs})
+
+    def update_chunks(self, docs: Iterable[Dict[str, Any]]):
+        pass # A moved chunk keeps its id and content, so its rerank scores still hold
+
+    def remove_chunks(self, chunk_ids: Iterable[str]):
+        self._evict(self._by_chunk, chunk_ids)
+
+    def remove_document(self, user_corpus: str, document_id: str):
+        self._evict(self._by_document, [document_id])
+
+    def stats(self) -> dict:
+        return self.cache.stats()
+
+rerank_cache = RerankCache()
@@ -1,10 +1,27 @@
+import logging
 from src.db.mongo import db
 from src.config import get_settings
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Awaitable, Callable, Optional
 from pydantic import BaseModel
-import voyageai
 import asyncio
+from functools import lru_cache
+import numpy as np
 from src.services.llm import LLMService
+from src.services.voyage import VOYAGE_MAX_BATCH_ITEMS, get_voyage_client, make_batches
+from src.services.vectors import decode_embedding, quantize_embedding
+from src.retrieval.embedding_cache import embedding_cache
+from src.retrieval.vector_index import vector_index
+from src.retrieval.bm25 import keyword_index
+from src.retrieval.batcher import EmbeddingBatcher
+from src.retrieval.rerank_cache import rerank_cache
+from src.services.cache import TTLCache
+from src.services.metrics import CACHE_LOOKUPS, timed
+from src.retrieval.deadline import within_budget
+
+logger = logging.getLogger(__name__)
+
+# Strategies whose search embeds the query text itself (decomposition embeds sub-questions, keyword nothing)
+QUERY_EMBEDDING_STRATEGIES = ("vector", "hybrid", "multi_query_vector", "multi_query_hybrid")
 
 class SearchResult(BaseModel):
     chunk_id: str
@@ -12,21 +29,96 @@ class SearchResult(BaseModel):
     content: str
     similarity: float
     metadata: Dict[str, Any]
+    chunk_index: Optional[int] = None # Position in its document; lets adjacent chunks be merged
 
 class SearchService:
     @staticmethod
     def get_embedding(text: str) -> List[float]:
         settings = get_settings()
-        vo = voyageai.Client(api_key=settings.VOYAGE_API_KEY)
+        vo = get_voyage_client()
         return vo.embed([text], model=settings.VOYAGE_MODEL, input_type="query").embeddings[0]
 
+    @staticmethod
+    def get_query_embeddings(texts: List[str]) -> List[List[float]]:
+        settings = get_settings()
+        vo = get_voyage_client()
+        return vo.embed(texts, model=settings.VOYAGE_MODEL, input_type="query").embeddings
+
+    @staticmethod
+    async def embed_query(text: str) -> List[float]:
+        with timed("embed"):
+            key = embedding_cache.make_key(text, input_type="query")
+            embedding = await embedding_cache.get(key)
+            if embedding is None:
+                # Misses from all in-flight requests are coalesced into one Voyage call
+                embedding = await query_embedding_batcher.embed(text)
+                await embedding_cache.set(key, embedding)
+            return embedding
+
+    @staticmethod
+    async def embed_queries(texts: List[str]) -> List[List[float]]:
+        """
+        Embed several queries at once. Cache misses go straight to Voyage, in as few calls as its
+        per-request limits allow, rather than through the cross-request batcher's small flushes.
+        """
+        with timed("embed"):
+            keys = [embedding_cache.make_key(text, input_type="query") for text in texts]
+            embeddings = await asyncio.gather(*(embedding_cache.get(key) for key in keys))
+
+            missing = list(dict.fromkeys(text for text, embedding in zip(texts, embeddings) if embedding is None))
+            if missing:
+                batches = make_batches(enumerate(missing), get_settings().EMBED_BATCH_MAX_TOKENS, VOYAGE_MAX_BATCH_ITEMS)
+                results = await asyncio.gather(*(
+                    asyncio.to_thread(SearchService.get_query_embeddings, [text for _, text in batch]) for batch in batches
+                ))
+                fresh = dict(zip(missing, (embedding for result in results for embedding in result)))
+                for i, text in enumerate(texts):
+                    if embeddings[i] is None:
+                        embeddings[i] = fresh[text]
+                        await embedding_cache.set(keys[i], embeddings[i])
+            return list(embeddings)
+
     @staticmethod
     async def vector_search(query_embedding: List[float], user_corpus: str, limit: int = 20) -> List[SearchResult]:
+        with timed("vector"):
+            if get_settings().VECTOR_BACKEND == "local":
+                docs = vector_index.search(query_embedding, user_corpus, limit)
+            else:
+                docs = await SearchService._atlas_vector_search(query_embedding, user_corpus, limit)
+
+        return [SearchResult(
+            chunk_id=str(doc["_id"]),
+            document_id=doc["document_id"],
+            content=doc["content"],
+            similarity=doc["score"],
+            metadata=doc.get("metadata", {}),
+            chunk_index=doc.get("chunk_index")
+        ) for doc in docs]
+
+    @staticmethod
+    def rescore(query_embedding: List[float], docs: List[Dict[str, Any]], limit: int) -> List[Dict[str, Any]]:
+        """Re-rank candidates by exact cosine against their full-precision `embedding`, on the Atlas score scale."""
+        if not docs:
+            return []
+        query = np.asarray(query_embedding, dtype=np.float32)
+        matrix = np.stack([decode_embedding(doc.pop("embedding")) for doc in docs])
+        norms = np.linalg.norm(matrix, axis=1) * (np.linalg.norm(query) or 1.0)
+        norms[norms == 0] = 1.0
+        cosines = (matrix @ query) / norms
+        top = np.argsort(-cosines)[:limit]
+        return [{**docs[i], "score": (1.0 + float(cosines[i])) / 2} for i in top]
+
+    @staticmethod
+    async def _atlas_vector_search(query_embedding: List[float], user_corpus: str, limit: int) -> List[Dict[str, Any]]:
+        settings = get_settings()
+        if settings.VECTOR_QUANTIZATION != "none":
+            return await SearchService._atlas_quantized_vector_search(query_embedding, user_corpus, limit)
+
         search_stage = {
             "index": "vector_index",
             "path": "embedding",
             "queryVector": query_embedding,
-            "numCandidates": 100,
+            "numCandidates": max(get_settings().VECTOR_NUM_CANDIDATES, limit),
             "limit": limit
         }
         
@@ -37,36 +129,69 @@ class SearchService:
         pipeline = [
             {"$vectorSearch": search_stage},
             {
-                "$project": {"_id": 1, "document_id": 1, "content": 1, "metadata": 1, "score": {"$meta": "vectorSearchScore"}}
+                "$project": {"_id": 1, "document_id": 1, "chunk_index": 1, "content": 1, "metadata": 1, "score": {"$meta": "vectorSearchScore"}}
             }
         ]
         
         # Access motor collection directly
         chunks = db.client[get_settings().MONGODB_DATABASE]["chunks"]
-        cursor = chunks.aggregate(pipeline)
-        
-        results = []
-        async for doc in cursor:
-            results.append(SearchResult(
-                chunk_id=str(doc["_id"]),
-                document_id=doc["document_id"],
-                content=doc["content"],
-                similarity=doc["score"],
-                metadata=doc.get("metadata", {})
-            ))
-        return results
+        return await chunks.aggregate(pipeline).to_list(length=None)
+
+    @staticmethod
+    async def _atlas_quantized_vector_search(query_embedding: List[float], user_corpus: str, limit: int) -> List[Dict[str, Any]]:
+        """
+        Stage one over-fetches VECTOR_RESCORE_FACTOR x limit candidates from the quantized index;
+        stage two rescores only those with their full-precision embeddings.
+        """
+        settings = get_settings()
+        candidates = limit * settings.VECTOR_RESCORE_FACTOR
+        search_stage = {
+            "index": "vector_index_quantized",
+            "path": "embedding_quantized",
+            "queryVector": quantize_embedding(query_embedding, settings.VECTOR_QUANTIZATION),
+            "numCandidates": max(settings.VECTOR_NUM_CANDIDATES, candidates),
+            "limit": candidates
+        }
+        if user_corpus:
+            search_stage["filter"] = {"user_corpus": {"$eq": user_corpus}}
+
+        pipeline = [
+            {"$vectorSearch": search_stage},
+            {"$project": {"_id": 1, "document_id": 1, "chunk_index": 1, "content": 1, "metadata": 1, "embedding": 1}}
+        ]
+        chunks = db.client[settings.MONGODB_DATABASE]["chunks"]
+        docs = await chunks.aggregate(pipeline).to_list(length=None)
+        return SearchService.rescore(query_embedding, docs, limit)
 
     @staticmethod
     async def keyword_search(query: str, user_corpus: str, limit: int = 20) -> List[SearchResult]:
+        with timed("keyword"):
+            if get_settings().KEYWORD_BACKEND == "local":
+                docs = keyword_index.search(query, user_corpus, limit)
+            else:
+                docs = await SearchService._atlas_keyword_search(query, user_corpus, limit)
+
+        return [SearchResult(
+            chunk_id=str(doc["_id"]),
+            document_id=doc["document_id"],
+            content=doc["content"],
+            similarity=doc["score"],
+            metadata=doc.get("metadata", {}),
+            chunk_index=doc.get("chunk_index")
+        ) for doc in docs]
+
+    @staticmethod
+    async def _atlas_keyword_search(query: str, user_corpus: str, limit: int) -> List[Dict[str, Any]]:
         search_operator = {
             "text": {"query": query, "path": "content"}
         }
         
         if user_corpus:
+            # Exact, non-scoring tenant filter (user_corpus is indexed as a token field)
             search_operator = {
                 "compound": {
                     "must": [{"text": {"query": query, "path": "content"}}],
-                    "filter": [{"text": {"query": user_corpus, "path": "user_corpus"}}]
+                    "filter": [{"equals": {"path": "user_corpus", "value": user_corpus}}]
                 }
             }
 
@@ -79,23 +204,12 @@ class SearchService:
             },
             {"$limit": limit},
             {
-                "$project": {"_id": 1, "document_id": 1, "content": 1, "metadata": 1, "score": {"$meta": "searchScore"}}
+                "$project": {"_id": 1, "document_id": 1, "chunk_index": 1, "content": 1, "metadata": 1, "score": {"$meta": "searchScore"}}
             }
         ]
         
         chunks = db.client[get_settings().MONGODB_DATABASE]["chunks"]
-        cursor = chunks.aggregate(pipeline)
-        
-        results = []
-        async for doc in cursor:
-            results.append(SearchResult(
-                chunk_id=str(doc["_id"]),
-                document_id=doc["document_id"],
-                content=doc["content"],
-                similarity=doc["score"],
-                metadata=doc.get("metadata", {})
-            ))
-        return results
+        return await chunks.aggregate(pipeline).to_list(length=None)
 
     @staticmethod
     def rrf_fusion(results_lists: List[List[SearchResult]], k: int = 60, weights: List[float] = None) -> List[SearchResult]:
@@ -105,16 +219,26 @@ class SearchService:
         if len(weights) != len(results_lists):
              raise ValueError("Number of weights must match number of result lists")
 
-        rrf_map = {}
-        for i, results in enumerate(results_lists):
-            weight = weights[i]
-            for rank, result in enumerate(results):
-                if result.chunk_id not in rrf_map:
-                    result.similarity = 0
-                    rrf_map[result.chunk_id] = result
-                rrf_map[result.chunk_id].similarity += weight * (1 / (k + rank))
-        
-        return sorted(rrf_map.values(), key=lambda x: x.similarity, reverse=True)
+        with timed("fusion"):
+            rrf_map = {}
+            for i, results in enumerate(results_lists):
+                weight = weights[i]
+                for rank, result in enumerate(results):
+                    if result.chunk_id not in rrf_map:
+                        result.similarity = 0
+                        rrf_map[result.chunk_id] = result
+                    rrf_map[result.chunk_id].similarity += weight * (1 / (k + rank))
+            
+            return sorted(rrf_map.values(), key=lambda x: x.similarity, reverse=True)
+
+    @staticmethod
+    def has_clear_winner(results: List[SearchResult]) -> bool:
+        margin = get_settings().RERANK_SKIP_MARGIN
+        if margin <= 0 or not results:
+            return False
+        if len(results) == 1:
+            return True
+        return results[0].similarity >= (1 + margin) * results[1].similarity
 
     @staticmethod
     def rerank_results(query: str, results: List[SearchResult], top_k: int = 20) -> List[SearchResult]:
@@ -122,139 +246,172 @@ class SearchService:
             return []
             
         settings = get_settings()
-        vo = voyageai.Client(api_key=settings.VOYAGE_API_KEY)
-        
-        # Extract content for reranking
-        documents = [r.content for r in results]
-        
-        try:
-            reranking = vo.rerank(query, documents, model=settings.VOYAGE_RERANK_MODEL, top_k=top_k)
-            
-            reranked_results = []
-            for r in reranking.results:
-                # Map back to original result using index
-                original_result = results[r.index]
-                # Update similarity score with reranking score
-                original_result.similarity = r.relevance_score
-                reranked_results.append(original_result)
-                
-            return reranked_results
-        except Exception as e:
-            print(f"ERROR: Reranking failed: {e}")
-            # Fallback to original order/scores if reranking fails
+
+        # Fused scores already decide the top result; keep fused order and skip the call
+        if SearchService.has_clear_winner(results):
             return results[:top_k]
 
+        key = rerank_cache.make_key(query, [r.chunk_id for r in results], top_k)
+        ranking = rerank_cache.get(key)
+
+        if ranking is None:
+            vo = get_voyage_client()
+            
+            # Extract content for reranking, trimmed to the per-document token budget (~4 chars/token)
+            max_chars = settings.RERANK_MAX_TOKENS_PER_DOC * 4
+            documents = [r.content[:max_chars] if max_chars > 0 else r.content for r in results]
+            
+            try:
+                reranking = vo.rerank(query, documents, model=settings.VOYAGE_RERANK_MODEL, top_k=top_k)
+            except Exception as e:
+                logger.warning(f"Reranking failed, keeping fused order: {e}")
+                # Fallback to original order/scores if reranking fails
+                return results[:top_k]
+
+            ranking = [(r.index, r.relevance_score) for r in reranking.results]
+            rerank_cache.set(key, ranking, [r.document_id for r in results])
+            
+        reranked_results = []
+        for index, score in ranking:
+            # Map back to original result using index; copied with the reranking score, since a
+            # rerank that overran its budget finishes after the caller already used `results`
+            reranked_results.append(results[index].model_copy(update={"similarity": score}))
+            
+        return reranked_results
+
     @staticmethod
-    async def hybrid_search(query: str, user_corpus: str = None, limit: int = 20) -> List[SearchResult]:
-        print(f"DEBUG: Starting Hybrid Search for query: '{query}' in corpus: '{user_corpus}'")
-        
-        # Sync embedding call (Voyage is sync client) wrapped if needed
-        query_vec = await asyncio.to_thread(SearchService.get_embedding, query)
-        print(f"DEBUG: Generated Embedding. Size: {len(query_vec)}")
+    async def hybrid_search(query: str, user_corpus: str = None, limit: int = 20, query_vec: Optional[List[float]] = None) -> List[SearchResult]:
+        logger.debug("Hybrid search in corpus %s: %r", user_corpus, query)
         
-        # Parallel search
-        vec_res, kw_res = await asyncio.gather(
-            SearchService.vector_search(query_vec, user_corpus),
-            SearchService.keyword_search(query, user_corpus)
-        )
+        # Cached; misses go through the shared embedding batcher
+        if query_vec is None:
+            query_vec = await SearchService.embed_query(query)
         
-        print(f"DEBUG: Vector Search Results: {len(vec_res)}")
-        print(f"DEBUG: Keyword Search Results: {len(kw_res)}")
-        
-        if vec_res:
-            print(f"DEBUG: Top Vector Match: {vec_res[0].content[:50]}... (Score: {vec_res[0].similarity})")
-        if kw_res:
-             print(f"DEBUG: Top Keyword Match: {kw_res[0].content[:50]}... (Score: {kw_res[0].similarity})")
+        # Parallel search; the keyword leg is dropped if it is still running too long after the vector leg
+        kw_task = asyncio.ensure_future(SearchService.keyword_search(query, user_corpus))
+        try:
+            vec_res = await SearchService.vector_search(query_vec, user_corpus)
+        except BaseException:
+            kw_task.cancel()
+            raise
+        kw_res = await within_budget("keyword", get_settings().KEYWORD_GRACE_SECONDS, kw_task, [], cancel_late=True)
+        logger.debug("Hybrid search legs: %d vector, %d keyword results", len(vec_res), len(kw_res))
 
         # Fuse
         vector_weight = get_settings().VECTOR_SEARCH_WEIGHT
         keyword_weight = 1.0 - vector_weight
-        print(f"DEBUG: Fusion Weights - Vector: {vector_weight}, Keyword: {keyword_weight}")
         
         final_results = SearchService.rrf_fusion([vec_res, kw_res], weights=[vector_weight, keyword_weight])[:limit]
-        print(f"DEBUG: Final Fused Results: {len(final_results)}")
+        logger.debug("Fused %d results (weights %.2f/%.2f)", len(final_results), vector_weight, keyword_weight)
         
         return final_results
 
+    @staticmethod
+    async def cached_rewrite(kind: str, query: str, rewrite: Callable[[], Awaitable[List[str]]]) -> List[str]:
+        """
+        Memoize LLM query rewrites; failed rewrites (just the original query) are not cached.
+        A rewrite over its budget falls back to the plain query but still fills the cache when it lands.
+        """
+        settings = get_settings()
+        key = (settings.GEMINI_MODEL, kind, " ".join(query.split()))
+        cached = get_rewrite_cache().get(key)
+        CACHE_LOOKUPS.labels(cache="rewrite", result="miss" if cached is None else "hit").inc()
+        if cached is not None:
+            return list(cached)
+
+        async def run() -> List[str]:
+            with timed("rewrite"):
+                queries = await rewrite()
+            if queries != [query]:
+                get_rewrite_cache().set(key, tuple(queries))
+            return queries
+
+        return await within_budget("rewrite", settings.REWRITE_BUDGET_SECONDS, run(), [query])
+
     @staticmethod
     async def generate_query_variations(query: str, n: int = 2) -> List[str]:
-        prompt = f"Generate {n} alternative ways to phrase this question for document search. Use different keywords and synonyms while maintaining the same intent. Return exactly {n} variations, one per line."
-        messages = [
-            {"role": "system", "content": prompt},
-            {"role": "user", "content": f"Query: {query}"}
-        ]
-        
-        response = await LLMService.get_response(messages)
-        variations = [line.strip() for line in response.split("\n") if line.strip()]
-        
-        # Ensure we have at least the original query
-        return [query] + variations[:n]
+        async def rewrite() -> List[str]:
+            prompt = f"Generate {n} alternative ways to phrase this question for document search. Use different keywords and synonyms while maintaining the same intent. Return exactly {n} variations, one per line."
+            messages = [
+                {"role": "system", "content": prompt},
+                {"role": "user", "content": f"Query: {query}"}
+            ]
+            
+            response = await LLMService.get_response(messages)
+            if LLMService.is_error(response):
+                return [query]
+            variations = [line.strip() for line in response.split("\n") if line.strip()]
+            
+            # Ensure we have at least the original query
+            return [query] + variations[:n]
+
+        return await SearchService.cached_rewrite(f"variations:{n}", query, rewrite)
 
     @staticmethod
     async def multi_query_vector_search(query: str, user_corpus: str, limit: int = 20) -> List[SearchResult]:
-        print(f"DEBUG: Generating variations for vector search: '{query}'")
         queries = await SearchService.generate_query_variations(query)
-        print(f"DEBUG: Generated variations: {queries}")
+        logger.debug("Query variations for vector search: %s", queries)
         
-        # Parallel search
-        tasks = [SearchService.vector_search(
-            await asyncio.to_thread(SearchService.get_embedding, q), 
-            user_corpus
-        ) for q in queries]
+        # One batched embedding call, then truly parallel searches
+        query_vecs = await SearchService.embed_queries(queries)
+        tasks = [SearchService.vector_search(vec, user_corpus) for vec in query_vecs]
         
         results_lists = await asyncio.gather(*tasks)
         return SearchService.rrf_fusion(results_lists)[:limit]
 
     @staticmethod
     async def multi_query_hybrid_search(query: str, user_corpus: str, limit: int = 20) -> List[SearchResult]:
-        print(f"DEBUG: Generating variations for hybrid search: '{query}'")
         queries = await SearchService.generate_query_variations(query)
+        logger.debug("Query variations for hybrid search: %s", queries)
         
-        # Parallel search
-        tasks = [SearchService.hybrid_search(q, user_corpus) for q in queries]
+        # One batched embedding call, then truly parallel searches
+        query_vecs = await SearchService.embed_queries(queries)
+        tasks = [SearchService.hybrid_search(q, user_corpus, query_vec=vec) for q, vec in zip(queries, query_vecs)]
         
         results_lists = await asyncio.gather(*tasks)
         return SearchService.rrf_fusion(results_lists)[:limit]
 
     @staticmethod
     async def decompose_query(query: str) -> List[str]:
-        prompt = "Analyze this query. If it consists of multiple distinct sub-questions, extract them (max 3). If it is a single valid question, return it as is. Return distinct queries, one per line."
-        messages = [
-            {"role": "system", "content": prompt},
-            {"role": "user", "content": f"Query: {query}"}
-        ]
-        
-        response = await LLMService.get_response(messages)
-        sub_queries = [line.strip() for line in response.split("\n") if line.strip()]
-        
-        # Fallback if empty
-        if not sub_queries:
-            sub_queries = [query]
+        async def rewrite() -> List[str]:
+            prompt = "Analyze this query. If it consists of multiple distinct sub-questions, extract them (max 3). If it is a single valid question, return it as is. Return distinct queries, one per line."
+            messages = [
+                {"role": "system", "content": prompt},
+                {"role": "user", "content": f"Query: {query}"}
+            ]
             
-        print(f"DEBUG: Decomposition result: {sub_queries}")
+            response = await LLMService.get_response(messages)
+            if LLMService.is_error(response):
+                return [query]
+            sub_queries = [line.strip() for line in response.split("\n") if line.strip()]
+            
+            # Fallback if empty
+            if not sub_queries:
+                sub_queries = [query]
+            return sub_queries
+
+        sub_queries = await SearchService.cached_rewrite("decompose", query, rewrite)
+        logger.debug("Query decomposition: %s", sub_queries)
         return sub_queries
 
     @staticmethod
     async def query_decompose_vector_search(query: str, user_corpus: str, limit: int = 20) -> List[SearchResult]:
-        print(f"DEBUG: Decomposing query for vector search: '{query}'")
         sub_queries = await SearchService.decompose_query(query)
         
-        # Parallel search
-        tasks = [SearchService.vector_search(
-            await asyncio.to_thread(SearchService.get_embedding, q), 
-            user_corpus
-        ) for q in sub_queries]
+        # One batched embedding call, then truly parallel searches
+        query_vecs = await SearchService.embed_queries(sub_queries)
+        tasks = [SearchService.vector_search(vec, user_corpus) for vec in query_vecs]
         
         results_lists = await asyncio.gather(*tasks)
         return SearchService.rrf_fusion(results_lists)[:limit]
 
     @staticmethod
     async def query_decompose_hybrid_search(query: str, user_corpus: str, limit: int = 20) -> List[SearchResult]:
-        print(f"DEBUG: Decomposing query for hybrid search: '{query}'")
         sub_queries = await SearchService.decompose_query(query)
         
-        # Parallel search
-        tasks = [SearchService.hybrid_search(q, user_corpus) for q in sub_queries]
+        # One batched embedding call, then truly parallel searches
+        query_vecs = await SearchService.embed_queries(sub_queries)
+        tasks = [SearchService.hybrid_search(q, user_corpus, query_vec=vec) for q, vec in zip(sub_queries, query_vecs)]
         
         results_lists = await asyncio.gather(*tasks)
         return SearchService.rrf_fusion(results_lists)[:limit]
@@ -265,7 +422,7 @@ class SearchService:
         initial_limit = 50
         final_limit = 20
         
-        print(f"DEBUG: Search Strategy: {strategy}, Initial Limit: {initial_limit}")
+        logger.debug("Search strategy %s, initial limit %d", strategy, initial_limit)
 
         results = []
         if strategy == "query_decompose_hybrid":
@@ -282,10 +439,23 @@ class SearchService:
             results = await SearchService.keyword_search(query, user_corpus, limit=initial_limit)
         else:
             # Default to vector
-            query_vec = await asyncio.to_thread(SearchService.get_embedding, query)
+            query_vec = await SearchService.embed_query(query)
             results = await SearchService.vector_search(query_vec, user_corpus, limit=initial_limit)
             
         # Rerank
-        print(f"DEBUG: Reranking {len(results)} results")
-        reranked = await asyncio.to_thread(SearchService.rerank_results, query, results, final_limit)
+        # Fused order is kept when the rerank overruns its budget
+        with timed("rerank"):
+            reranked = await within_budget(
+                "rerank",
+                get_settings().RERANK_BUDGET_SECONDS,
+                asyncio.to_thread(SearchService.rerank_results, query, results, final_limit),
+                results[:final_limit],
+            )
         return reranked
+
+query_embedding_batcher = EmbeddingBatcher(SearchService.get_query_embeddings)
+
+@lru_cache
+def get_rewrite_cache() -> TTLCache:
+    settings = get_settings()
+    return TTLCache(maxsize=settings.REWRITE_CACHE_SIZE, ttl=settings.REWRITE_CACHE_TTL_SECONDS)
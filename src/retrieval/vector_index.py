@@ -0,0 +1,236 @@
+import heapq
+import logging
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+from src.config import get_settings
+from src.services.vectors import POPCOUNT, decode_embedding, quantize_binary
+
+logger = logging.getLogger(__name__)
+
+class CorpusVectorIndex:
+    """
+    Vectors of a single user_corpus. Small corpora are scanned brute-force with NumPy;
+    once a corpus grows past VECTOR_INDEX_HNSW_THRESHOLD an HNSW graph is built on top
+    (when hnswlib is installed). Removed chunks are tombstoned and compacted lazily.
+    With VECTOR_QUANTIZATION=binary, brute-force scans first shortlist candidates by Hamming
+    distance over sign-bit codes (32x smaller than the floats) and then rescore only the
+    shortlist with the float vectors. int8 codes are only used on Atlas: in NumPy an int8
+    scan is no faster than the float32 one, so the local index keeps scanning floats.
+    """
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.size = 0 # Used slots, including tombstones
+        self.live = 0
+        self.vectors = np.empty((0, dim), dtype=np.float32)
+        self.alive = np.zeros(0, dtype=bool)
+        self.payloads: List[Optional[Dict[str, Any]]] = []
+        self.slots: Dict[str, int] = {}
+        self.hnsw = None
+
+        # Sign bits, padded to whole uint64 words so Hamming distances can use 64-bit popcounts
+        binary = get_settings().VECTOR_QUANTIZATION == "binary"
+        self.code_bytes = -(-dim // 64) * 8
+        self.codes = np.zeros((0, self.code_bytes), dtype=np.uint8) if binary else None
+
+    def _grow(self, needed: int):
+        capacity = len(self.vectors)
+        if needed <= capacity:
+            return
+        new_capacity = max(needed, capacity * 2, 64)
+        vectors = np.empty((new_capacity, self.dim), dtype=np.float32)
+        vectors[:self.size] = self.vectors[:self.size]
+        alive = np.zeros(new_capacity, dtype=bool)
+        alive[:self.size] = self.alive[:self.size]
+        self.vectors, self.alive = vectors, alive
+        if self.codes is not None:
+            codes = np.zeros((new_capacity, self.code_bytes), dtype=np.uint8)
+            codes[:self.size] = self.codes[:self.size]
+            self.codes = codes
+        if self.hnsw is not None:
+            self.hnsw.resize_index(new_capacity)
+
+    def add(self, chunk_id: str, payload: Dict[str, Any], embedding: np.ndarray):
+        if chunk_id in self.slots:
+            return
+        norm = np.linalg.norm(embedding)
+        vector = embedding / norm if norm else embedding
+
+        self._grow(self.size + 1)
+        slot = self.size
+        self.vectors[slot] = vector
+        self.alive[slot] = True
+        if self.codes is not None:
+            self.codes[slot] = self._encode(vector)
+        self.payloads.append(payload)
+        self.slots[chunk_id] = slot
+        self.size += 1
+        self.live += 1
+
+        if self.hnsw is not None:
+            self.hnsw.add_items(vector[np.newaxis, :], [slot])
+
+    def remove(self, chunk_id: str) -> bool:
+        slot = self.slots.pop(chunk_id, None)
+        if slot is None:
+            return False
+        self.alive[slot] = False
+        self.payloads[slot] = None
+        self.live -= 1
+        if self.hnsw is not None:
+            self.hnsw.mark_deleted(slot)
+        if self.size > 1024 and self.live < self.size // 2:
+            self._compact()
+        return True
+
+    def _compact(self):
+        keep = np.flatnonzero(self.alive[:self.size])
+        self.vectors = self.vectors[keep].copy()
+        self.alive = np.ones(len(keep), dtype=bool)
+        if self.codes is not None:
+            self.codes = self.codes[keep].copy()
+        self.payloads = [self.payloads[i] for i in keep]
+        self.slots = {p["_id"]: i for i, p in enumerate(self.payloads)}
+        self.size = self.live = len(keep)
+        # Labels changed; the graph is rebuilt on the next search if still needed
+        self.hnsw = None
+
+    def _build_hnsw(self):
+        settings = get_settings()
+        index = hnswlib.Index(space="ip", dim=self.dim)
+        index.init_index(max_elements=max(len(self.vectors), 64), ef_construction=200, M=16)
+        slots = np.flatnonzero(self.alive[:self.size])
+        index.add_items(self.vectors[slots], slots)
+        index.set_ef(settings.VECTOR_NUM_CANDIDATES)
+        self.hnsw = index
+        logger.info(f"Built HNSW graph over {len(slots)} vectors")
+
+    def search(self, query: np.ndarray, limit: int) -> List[tuple]:
+        """Returns (cosine, payload) pairs, best first."""
+        k = min(limit, self.live)
+        if k <= 0:
+            return []
+
+        settings = get_settings()
+        if self.hnsw is None and hnswlib is not None and self.live >= settings.VECTOR_INDEX_HNSW_THRESHOLD:
+            self._build_hnsw()
+
+        if self.hnsw is not None:
+            self.hnsw.set_ef(max(settings.VECTOR_NUM_CANDIDATES, k))
+            labels, distances = self.hnsw.knn_query(query, k=k)
+            return [(1.0 - float(d), self.payloads[int(l)]) for l, d in zip(labels[0], distances[0])]
+
+        candidates = k * settings.VECTOR_RESCORE_FACTOR
+        if self.codes is not None and self.live > candidates:
+            return self._two_stage_search(query, k, candidates)
+
+        scores = self.vectors[:self.size] @ query
+        scores[~self.alive[:self.size]] = -np.inf
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[i]), self.payloads[i]) for i in top]
+
+    def _encode(self, vector: np.ndarray) -> np.ndarray:
+        code = np.zeros(self.code_bytes, dtype=np.uint8)
+        packed = quantize_binary(vector)
+        code[:len(packed)] = packed
+        return code
+
+    def _two_stage_search(self, query: np.ndarray, k: int, candidates: int) -> List[tuple]:
+        # Fewer differing sign bits (Hamming distance) = closer
+        diff = np.bitwise_xor(self.codes[:self.size], self._encode(query))
+        if hasattr(np, "bitwise_count"): # NumPy >= 2.0
+            distances = np.bitwise_count(diff.view(np.uint64)).sum(axis=1, dtype=np.uint32)
+        else:
+            distances = POPCOUNT[diff].sum(axis=1)
+        coarse = -distances.astype(np.float32)
+        coarse[~self.alive[:self.size]] = -np.inf
+        shortlist = np.argpartition(-coarse, candidates - 1)[:candidates]
+
+        # Exact cosine over the shortlist only
+        scores = self.vectors[shortlist] @ query
+        order = np.argsort(-scores)[:k]
+        return [(float(scores[i]), self.payloads[shortlist[i]]) for i in order]
+
+
+class VectorIndex:
+    """In-process vector index partitioned by user_corpus."""
+    def __init__(self):
+        self.corpora: Dict[str, CorpusVectorIndex] = {}
+        self.chunk_corpus: Dict[str, str] = {}
+
+    def add_chunks(self, docs: Iterable[Dict[str, Any]]):
+        for doc in docs:
+            embedding = doc.get("embedding")
+            if embedding is None:
+                continue
+            vector = decode_embedding(embedding)
+            corpus = doc["user_corpus"]
+            index = self.corpora.get(corpus)
+            if index is None:
+                index = self.corpora[corpus] = CorpusVectorIndex(dim=len(vector))
+
+            chunk_id = str(doc["_id"])
+            index.add(chunk_id, {
+                "_id": chunk_id,
+                "document_id": doc["document_id"],
+                "chunk_index": doc.get("chunk_index"),
+                "content": doc["content"],
+                "metadata": doc.get("metadata", {}),
+            }, vector)
+            self.chunk_corpus[chunk_id] = corpus
+
+    def remove_chunks(self, chunk_ids: Iterable[str]):
+        for chunk_id in chunk_ids:
+            corpus = self.chunk_corpus.pop(chunk_id, None)
+            if corpus is not None:
+                self.corpora[corpus].remove(chunk_id)
+
+    def update_chunks(self, docs: Iterable[Dict[str, Any]]):
+        for doc in docs:
+            chunk_id = str(doc["_id"])
+            corpus = self.chunk_corpus.get(chunk_id)
+            if corpus is not None:
+                index = self.corpora[corpus]
+                slot = index.slots[chunk_id]
+                # Replaced rather than mutated: search results may still hold the old payload
+                index.payloads[slot] = {**index.payloads[slot], "chunk_index": doc["chunk_index"]}
+
+    def document_chunks(self, user_corpus: str, document_id: str) -> Dict[str, Optional[int]]:
+        index = self.corpora.get(user_corpus)
+        if index is None:
+            return {}
+        return {
+            cid: index.payloads[slot]["chunk_index"]
+            for cid, slot in index.slots.items() if index.payloads[slot]["document_id"] == document_id
+        }
+
+    def remove_document(self, user_corpus: str, document_id: str):
+        self.remove_chunks(list(self.document_chunks(user_corpus, document_id)))
+
+    def search(self, query_embedding: List[float], user_corpus: Optional[str], limit: int = 20) -> List[Dict[str, Any]]:
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+
+        if user_corpus:
+            index = self.corpora.get(user_corpus)
+            hits = index.search(query, limit) if index else []
+        else:
+            hits = heapq.nlargest(
+                limit,
+                (hit for index in self.corpora.values() for hit in index.search(query, limit)),
+                key=lambda hit: hit[0],
+            )
+
+        # Same scale as Atlas vectorSearchScore for cosine: (1 + cos) / 2
+        return [{**payload, "score": (1.0 + cosine) / 2} for cosine, payload in hits]
+
+vector_index = VectorIndex()
@@ -1,10 +1,22 @@
-from fastapi import APIRouter
+import asyncio
+import json
+import logging
+import time
+from contextlib import nullcontext
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
-from typing import List
+from typing import List, Optional
 
 from src.services.llm import LLMService
-from src.retrieval.service import SearchService
+from src.retrieval.service import QUERY_EMBEDDING_STRATEGIES, SearchService
+from src.retrieval.context import Passage, context_packer
+from src.retrieval.deadline import Deadline, degraded_stages
+from src.retrieval.answer_cache import answer_cache, corpus_versions, CachedAnswer
 from src.config import get_settings
+from src.services.metrics import timed
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/chat", tags=["Chat"])
 
@@ -16,54 +28,233 @@ class ChatRequest(BaseModel):
 class ChatResponse(BaseModel):
     answer: str
     sources: List[dict]
+    degraded: List[str] = [] # Search stages cut short by the request deadline (rewrite, keyword, rerank)
 
-@router.post("/query", response_model=ChatResponse)
-async def chat_endpoint(request: ChatRequest):
-    settings = get_settings()
-    
-    # 1. Retrieval
-    # user_email acts as the corpus identifier
-    results = await SearchService.search(
-        query=request.query, 
-        user_corpus=request.user_email, 
-        strategy=request.rag_strategy
-    )
-    
-    if not results:
-        return ChatResponse(answer="No info found.", sources=[])
-    
-    # 2. Context
-    context_text = "\n\n".join([f"Source: {r.content}" for r in results[:5]])
-    
-    # 3. Generate Answer
-    from src.services.llm import LLMService
-
-    system_prompt = ( "You are a helpful AI assistant that answers questions based solely on the provided context. "
-        "Your task is to provide accurate, detailed answers using ONLY the information available in the context below.\n\n"
-        "IMPORTANT RULES:\n"
-        "- Only answer based on the provided context (texts, tables, and images)\n"
-        "- If the answer cannot be found in the context, respond with: 'I don't have enough information in the provided context to answer that question.'\n"
-        "- Do not use external knowledge or make assumptions beyond what's explicitly stated\n"
-        "- When referencing information, be specific and cite relevant parts of the context\n"
-        "- Synthesize information from texts, tables, and images to provide comprehensive answers\n\n")
-    user_message = f"Context:\n{context_text}\n\nQuestion: {request.query}"
-    
-    messages = [
-        {"role": "system", "content": system_prompt},
+class BatchChatRequest(BaseModel):
+    queries: List[str]
+    user_email: str
+    rag_strategy: str = "vector"
+    stream: bool = False # NDJSON, one line per query as soon as it is answered
+
+class BatchChatResult(ChatResponse):
+    index: int
+    query: str
+    error: Optional[str] = None
+
+class BatchChatResponse(BaseModel):
+    results: List[BatchChatResult]
+
+SYSTEM_PROMPT = ( "You are a helpful AI assistant that answers questions based solely on the provided context. "
+    "Your task is to provide accurate, detailed answers using ONLY the information available in the context below.\n\n"
+    "IMPORTANT RULES:\n"
+    "- Only answer based on the provided context (texts, tables, and images)\n"
+    "- If the answer cannot be found in the context, respond with: 'I don't have enough information in the provided context to answer that question.'\n"
+    "- Do not use external knowledge or make assumptions beyond what's explicitly stated\n"
+    "- When referencing information, be specific and cite relevant parts of the context\n"
+    "- Synthesize information from texts, tables, and images to provide comprehensive answers\n\n")
+
+NO_INFO_ANSWER = "No info found."
+
+DISCONNECT_POLL_SECONDS = 1.0
+
+def build_messages(query: str, passages: List[Passage]) -> List[dict]:
+    context_text = "\n\n".join([f"Source: {p.content}" for p in passages])
+    user_message = f"Context:\n{context_text}\n\nQuestion: {query}"
+
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
         {"role": "user", "content": user_message}
     ]
-    
-    answer_text = await LLMService.get_response(messages)
-    
-    # 4. Response
-    sources = [
+
+def format_sources(passages: List[Passage]) -> List[dict]:
+    return [
         {
-            "content": r.content[:200], 
-            "score": r.similarity,
-            "document_id": r.document_id,
-            "metadata": r.metadata
-        } 
-        for r in results[:5]
+            "content": p.content[:200],
+            "score": p.score,
+            "document_id": p.document_id,
+            "chunk_indexes": p.chunk_indexes,
+            "metadata": p.metadata
+        }
+        for p in passages
     ]
-    
-    return ChatResponse(answer=answer_text, sources=sources)
+
+async def answer_query(query: str, user_email: str, strategy: str,
+                       search_slots: Optional[asyncio.Semaphore] = None,
+                       llm_slots: Optional[asyncio.Semaphore] = None) -> ChatResponse:
+    """Cache lookup, retrieval and generation for one question. Batch callers pass semaphores to bound each phase."""
+    settings = get_settings()
+    started = time.perf_counter()
+    # Only where the search embeds the query anyway, so the lookup costs no extra Voyage call
+    use_cache = settings.SEMANTIC_CACHE_ENABLED and strategy in QUERY_EMBEDDING_STRATEGIES
+
+    async with search_slots or nullcontext():
+        # Search deadline for this request; covers the cache lookup's query embedding too
+        Deadline.start()
+
+        # 0. Semantic cache: a paraphrase of an earlier question on an unchanged corpus
+        if use_cache:
+            # Same (cached) embedding the vector leg of the search below reuses
+            query_vec = await SearchService.embed_query(query)
+            version = await corpus_versions.get(user_email)
+            cached = answer_cache.lookup(user_email, strategy, query_vec, version)
+            if cached:
+                return ChatResponse(answer=cached.answer, sources=cached.sources)
+
+        # 1. Retrieval
+        # user_email acts as the corpus identifier
+        results = await SearchService.search(
+            query=query,
+            user_corpus=user_email,
+            strategy=strategy
+        )
+        degraded = degraded_stages()
+
+    if not results:
+        return ChatResponse(answer=NO_INFO_ANSWER, sources=[], degraded=degraded)
+
+    # 2. Context (token-budgeted, neighbors merged) + 3. Generate Answer
+    passages = context_packer.pack(results)
+    async with llm_slots or nullcontext():
+        with timed("llm"):
+            answer_text = await LLMService.get_response(build_messages(query, passages))
+    sources = format_sources(passages)
+
+    # Degraded answers are not cached, so the next paraphrase gets the full pipeline
+    if use_cache and not degraded and not LLMService.is_error(answer_text):
+        answer_cache.store(user_email, strategy, query_vec, CachedAnswer(
+            query=query,
+            answer=answer_text,
+            sources=sources,
+            version=version,
+            latency=time.perf_counter() - started,
+            created_at=time.time(),
+        ))
+
+    # 4. Response
+    return ChatResponse(answer=answer_text, sources=sources, degraded=degraded)
+
+@router.post("/query", response_model=ChatResponse)
+async def chat_endpoint(request: ChatRequest):
+    return await answer_query(request.query, request.user_email, request.rag_strategy)
+
+async def cancel_on_disconnect(http_request: Request, tasks: List[asyncio.Task]):
+    """Cancel `tasks` once the client has gone away (checked every DISCONNECT_POLL_SECONDS)."""
+    while not all(task.done() for task in tasks):
+        if await http_request.is_disconnected():
+            logger.info("Client disconnected; cancelling batch")
+            for task in tasks:
+                task.cancel()
+            return
+        await asyncio.sleep(DISCONNECT_POLL_SECONDS)
+
+@router.post("/batch-query", response_model=BatchChatResponse)
+async def batch_chat_endpoint(request: BatchChatRequest, http_request: Request):
+    """
+    Answers many questions against one corpus. Query embeddings missing from the cache are
+    fetched up front, straight from Voyage in as few calls as its per-request limits allow
+    (one for up to 1000 queries; per query if that fails); searches (incl. rerank)
+    and LLM calls then run under BATCH_SEARCH_CONCURRENCY / BATCH_LLM_CONCURRENCY.
+    Returns results in input order, or with `stream` as NDJSON lines in completion order
+    (each carrying its `index`). Remaining questions are cancelled if the client disconnects.
+    """
+    settings = get_settings()
+    if len(request.queries) > settings.BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=400, detail=f"At most {settings.BATCH_MAX_QUERIES} queries per batch")
+
+    # Warms the embedding cache, so every per-query embed below is a cache hit
+    if request.rag_strategy in QUERY_EMBEDDING_STRATEGIES:
+        try:
+            await SearchService.embed_queries(request.queries)
+        except Exception as e:
+            # Each question then embeds its own query, and only those that fail again fail
+            logger.warning(f"Batch query embedding failed, embedding per query: {e}")
+
+    search_slots = asyncio.Semaphore(settings.BATCH_SEARCH_CONCURRENCY)
+    llm_slots = asyncio.Semaphore(settings.BATCH_LLM_CONCURRENCY)
+
+    async def run(index: int, query: str) -> BatchChatResult:
+        try:
+            response = await answer_query(query, request.user_email, request.rag_strategy, search_slots, llm_slots)
+            return BatchChatResult(index=index, query=query, **response.model_dump())
+        except Exception as e:
+            # One failed question doesn't fail the batch
+            logger.error(f"Batch query {index} failed: {e}")
+            return BatchChatResult(index=index, query=query, answer="", sources=[], error=str(e))
+
+    tasks = [asyncio.create_task(run(i, q)) for i, q in enumerate(request.queries)]
+
+    if not request.stream:
+        watcher = asyncio.create_task(cancel_on_disconnect(http_request, tasks))
+        try:
+            return BatchChatResponse(results=await asyncio.gather(*tasks))
+        finally:
+            watcher.cancel()
+            for task in tasks:
+                task.cancel()
+
+    async def ndjson():
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                result = await next_done
+                yield result.model_dump_json() + "\n"
+        finally:
+            # Client went away: stop the remaining questions
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+@router.get("/cache/stats")
+async def cache_stats():
+    """Hit rate and total latency saved by the semantic answer cache of this process."""
+    return answer_cache.stats()
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@router.post("/query/stream")
+async def chat_stream_endpoint(request: ChatRequest, http_request: Request):
+    """
+    Server-Sent Events variant of /chat/query.
+    Emits `sources` (with any `degraded` stages) once reranking finishes, then one `token` event per LLM delta,
+    then `done` (or `error`). Generation stops as soon as the client disconnects.
+    """
+    async def event_stream():
+        # Any failure after the response has started (search, rerank, packing or generation)
+        # ends the stream with an `error` event rather than a silently truncated body
+        tokens = None
+        try:
+            Deadline.start()
+            results = await SearchService.search(
+                query=request.query,
+                user_corpus=request.user_email,
+                strategy=request.rag_strategy
+            )
+            passages = context_packer.pack(results)
+            yield sse_event("sources", {"sources": format_sources(passages), "degraded": degraded_stages()})
+
+            if not results:
+                yield sse_event("token", {"text": NO_INFO_ANSWER})
+                yield sse_event("done", {})
+                return
+
+            tokens = LLMService.stream_response(build_messages(request.query, passages))
+            with timed("llm"):
+                async for token in tokens:
+                    if await http_request.is_disconnected():
+                        logger.info("Client disconnected; stopping generation")
+                        return
+                    yield sse_event("token", {"text": token})
+            yield sse_event("done", {})
+        except Exception as e:
+            logger.error(f"Streaming answer failed: {e}")
+            yield sse_event("error", {"detail": f"{LLMService.ERROR_PREFIX} {str(e)}"})
+        finally:
+            if tokens is not None:
+                await tokens.aclose()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
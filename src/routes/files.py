@@ -1,9 +1,25 @@
-from fastapi import APIRouter, UploadFile, File, Form, Depends
+import asyncio
+import json
+import logging
+from contextlib import ExitStack
+from datetime import datetime
+from fastapi import APIRouter, UploadFile, File, Form, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from src.services.storage import StorageService
+from bson import ObjectId
+from beanie import PydanticObjectId
+from src.config import get_settings
+from src.services.storage import StorageService, StoredFile, FileTooLargeError
+from src.services.archives import ArchiveMember, is_archive, guess_content_type, open_archive
 from src.tasks.ingestion import IngestionTask
-from src.models.files import FileMetadata, Chunk
-from typing import List
+from src.models.files import FileMetadata, FileSummary, Chunk, ChunkSummary
+from src.ingestion.progress import ProgressReporter, progress_hub, to_event, PROGRESS_FIELDS
+from src.ingestion.service import IngestionService
+from src.retrieval.index_sync import index_sync
+from src.retrieval.answer_cache import corpus_versions
+from typing import Awaitable, Callable, List, Optional
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/files", tags=["Files"])
 
@@ -14,26 +30,163 @@ async def upload_file(
 ):
     # 1. Store
     # Use user_email as the corpus identifier
-    gridfs_id = await StorageService.upload_file(file, metadata={"user_corpus": user_email, "user_email": user_email})
+    try:
+        stored = await StorageService.upload_file(file, metadata={"user_corpus": user_email, "user_email": user_email})
+    except FileTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
     
     # 2. Meta
     file_doc = FileMetadata(
         user_corpus=user_email,
         user_email=user_email,
         filename=file.filename,
-        gridfs_id=str(gridfs_id),
-        file_size=file.size or 0,
+        gridfs_id=str(stored.gridfs_id),
+        file_size=stored.size,
         content_type=file.content_type,
+        content_hash=stored.content_hash,
         status="pending"
     )
     await file_doc.insert()
     
     # 3. Queue
-    task = IngestionTask(file_id=str(file_doc.id))
+    task = IngestionTask.for_file(file_doc)
     await task.push()
     
     return {"message": "Queued", "file_id": str(file_doc.id)}
 
+class RejectedFile(BaseModel):
+    filename: str
+    reason: str
+
+class BatchUploadResponse(BaseModel):
+    message: str
+    batch_id: str
+    file_ids: List[str]
+    rejected: List[RejectedFile]
+
+class BatchProgress(BaseModel):
+    batch_id: str
+    total: int
+    pending: int
+    completed: int
+    failed: int
+    done: bool
+
+@router.post("/upload-batch", response_model=BatchUploadResponse)
+async def upload_batch(
+    user_email: str = Form(...),
+    files: List[UploadFile] = File(...)
+):
+    """
+    Bulk ingestion: many files and/or zip/tar archives in one request. Every file (or archive
+    member) is streamed into GridFS concurrently, then all metadata documents and ingestion
+    tasks are written with one insert_many each. Track the batch with GET /files/batches/{batch_id}.
+    """
+    settings = get_settings()
+    batch_id = str(ObjectId())
+    gridfs_metadata = {"user_corpus": user_email, "user_email": user_email, "batch_id": batch_id}
+    slots = asyncio.Semaphore(settings.BULK_UPLOAD_CONCURRENCY)
+    stored: List[FileMetadata] = []
+    rejected: List[RejectedFile] = []
+
+    async def store(filename: str, content_type: str, read: Callable[[int], Awaitable[bytes]]):
+        try:
+            result: StoredFile = await StorageService.upload_stream(filename, read, gridfs_metadata)
+        except FileTooLargeError as e:
+            rejected.append(RejectedFile(filename=filename, reason=str(e)))
+            return
+        stored.append(FileMetadata(
+            id=PydanticObjectId(),
+            user_corpus=user_email,
+            user_email=user_email,
+            filename=filename,
+            gridfs_id=str(result.gridfs_id),
+            file_size=result.size,
+            content_type=content_type,
+            content_hash=result.content_hash,
+            batch_id=batch_id,
+            status="pending"
+        ))
+
+    async def store_limited(filename: str, content_type: str, read: Callable[[int], Awaitable[bytes]]):
+        async with slots:
+            await store(filename, content_type, read)
+
+    async def store_sequential(members: List[ArchiveMember]):
+        for member in members:
+            await store_limited(member.filename, member.content_type, member.read)
+
+    with ExitStack() as archives:
+        jobs = []
+        count = 0
+        for file in files:
+            if not is_archive(file.filename):
+                count += 1
+                jobs.append(store_limited(file.filename, file.content_type or guess_content_type(file.filename), file.read))
+                continue
+            try:
+                # Reading the member list can mean decompressing the archive; keep it off the event loop
+                contents = await asyncio.to_thread(archives.enter_context, open_archive(file.filename, file.file))
+            except Exception as e:
+                rejected.append(RejectedFile(filename=file.filename, reason=f"Unreadable archive: {e}"))
+                continue
+            count += len(contents.members)
+            if contents.sequential:
+                jobs.append(store_sequential(contents.members))
+            else:
+                jobs.extend(store_limited(m.filename, m.content_type, m.read) for m in contents.members)
+
+        if count > settings.BULK_MAX_FILES:
+            for job in jobs:
+                job.close() # Never started
+            raise HTTPException(status_code=400, detail=f"At most {settings.BULK_MAX_FILES} files per batch")
+
+        results = await asyncio.gather(*jobs, return_exceptions=True)
+
+    try:
+        errors = [r for r in results if isinstance(r, BaseException)]
+        if errors:
+            raise errors[0]
+        if stored:
+            # One round-trip each for all metadata documents and all ingestion tasks
+            await FileMetadata.insert_many(stored)
+            await IngestionTask.insert_many([IngestionTask.for_file(f) for f in stored])
+    except Exception:
+        # Nothing was queued; don't leave orphaned blobs behind
+        await asyncio.gather(*(StorageService.delete_file(f.gridfs_id) for f in stored), return_exceptions=True)
+        raise
+
+    logger.info(f"Batch {batch_id}: queued {len(stored)} files, rejected {len(rejected)}")
+    return BatchUploadResponse(
+        message="Queued",
+        batch_id=batch_id,
+        file_ids=[str(f.id) for f in stored],
+        rejected=rejected,
+    )
+
+@router.get("/batches/{batch_id}", response_model=BatchProgress)
+async def batch_progress(batch_id: str, user_email: str):
+    """Aggregate ingestion status of an upload batch."""
+    counts = {"pending": 0, "completed": 0, "failed": 0}
+    pipeline = [
+        {"$match": {"batch_id": batch_id, "user_email": user_email}},
+        {"$group": {"_id": "$status", "count": {"$sum": 1}}},
+    ]
+    async for row in FileMetadata.get_motor_collection().aggregate(pipeline):
+        counts[row["_id"]] = counts.get(row["_id"], 0) + row["count"]
+
+    total = sum(counts.values())
+    if not total:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return BatchProgress(
+        batch_id=batch_id,
+        total=total,
+        pending=total - counts["completed"] - counts["failed"],
+        completed=counts["completed"],
+        failed=counts["failed"],
+        done=counts["completed"] + counts["failed"] == total,
+    )
+
 class QAPair(BaseModel):
     question: str
     answer: str
@@ -54,40 +207,103 @@ async def ingest_qa_pairs(request: QAIngestRequest):
     filename = f"qa_session_{request.heading.lower().replace(' ', '_')}.md"
     
     # 2. Store
-    gridfs_id = await StorageService.upload_bytes(
-        filename=filename, 
-        content=file_bytes, 
-        metadata={"user_corpus": request.user_email, "user_email": request.user_email}
-    )
+    try:
+        stored = await StorageService.upload_bytes(
+            filename=filename, 
+            content=file_bytes, 
+            metadata={"user_corpus": request.user_email, "user_email": request.user_email}
+        )
+    except FileTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
     
     # 3. Meta
     file_doc = FileMetadata(
         user_corpus=request.user_email,
         user_email=request.user_email,
         filename=filename,
-        gridfs_id=str(gridfs_id),
-        file_size=len(file_bytes),
+        gridfs_id=str(stored.gridfs_id),
+        file_size=stored.size,
         content_type="text/markdown",
+        content_hash=stored.content_hash,
         status="pending"
     )
     await file_doc.insert()
-    
-    # 4. Queue
-    task = IngestionTask(file_id=str(file_doc.id))
+
+    # 4. Small sessions are chunked natively and embedded right away (one embedding request)
+    if len(request.qa_pairs) <= get_settings().EMBED_BATCH_MAX_ITEMS:
+        try:
+            await IngestionService.process_document(str(file_doc.id), text=md_content)
+            return {"message": "Ingested Q&A Session", "file_id": str(file_doc.id)}
+        except Exception as e:
+            logger.warning(f"Inline Q&A ingestion of {file_doc.id} failed ({e}); queueing it")
+            await ProgressReporter(file_doc.id).update(status="pending", stage="queued", error_message=None)
+
+    # 5. Queue
+    task = IngestionTask.for_file(file_doc)
     await task.push()
     
     return {"message": "Queued Q&A Ingestion", "file_id": str(file_doc.id)}
 
-@router.get("/list")
-async def list_files(user_email: str):
-    files = await FileMetadata.find(FileMetadata.user_email == user_email).sort("-created_at").to_list()
-    return list(files)
+@router.get("/list", response_model=List[FileSummary])
+async def list_files(
+    user_email: str,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000)
+):
+    """
+    Newest first, one page at a time. When more files exist, the `X-Next-Cursor` header
+    holds the value to pass as `cursor` for the next page.
+    """
+    filters = [FileMetadata.user_email == user_email]
+    if cursor:
+        try:
+            filters.append(FileMetadata.id < PydanticObjectId(cursor))
+        except Exception:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
 
-from fastapi import HTTPException
+    files = await FileMetadata.find(*filters).sort("-_id").limit(limit + 1).project(FileSummary).to_list()
+    if len(files) > limit:
+        files = files[:limit]
+        response.headers["X-Next-Cursor"] = str(files[-1].id)
+    return files
 
-@router.delete("/{file_id}")
-async def delete_file(file_id: str, user_email: str):
-    # 1. Verify ownership
+@router.get("/events")
+async def file_events(user_email: str, request: Request):
+    """
+    Server-Sent Events with the ingestion progress of the user's files, replacing /files/list polling.
+    Starts with a `progress` event per file still in flight, then one per change (stage,
+    chunks_embedded/chunks_total, status, error_message).
+    """
+    settings = get_settings()
+    queue = progress_hub.subscribe(user_email)
+
+    async def event_stream():
+        try:
+            projection = {"_id": 1, **{f: 1 for f in PROGRESS_FIELDS}}
+            in_flight = FileMetadata.get_motor_collection().find(
+                {"user_email": user_email, "status": "pending"}, projection
+            )
+            async for doc in in_flight:
+                yield f"event: progress\ndata: {json.dumps(to_event(doc))}\n\n"
+
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), settings.PROGRESS_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: progress\ndata: {json.dumps(event)}\n\n"
+        finally:
+            progress_hub.unsubscribe(user_email, queue)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def get_owned_file(file_id: str, user_email: str) -> FileMetadata:
     try:
         file_doc = await FileMetadata.get(file_id)
     except Exception:
@@ -98,16 +314,78 @@ async def delete_file(file_id: str, user_email: str):
         
     if file_doc.user_email != user_email:
         raise HTTPException(status_code=403, detail="Unauthorized")
+    return file_doc
+
+@router.put("/{file_id}")
+async def replace_file(
+    file_id: str,
+    user_email: str = Form(...),
+    file: UploadFile = File(...)
+):
+    """
+    Upload a new version of an existing file. The worker re-chunks it and only embeds chunks
+    whose content changed; the current chunks stay searchable until the new ones are in place.
+    """
+    file_doc = await get_owned_file(file_id, user_email)
+    # Status stays pending while the worker runs; a second task would update the same chunks concurrently
+    if file_doc.status == "pending":
+        raise HTTPException(status_code=409, detail="This file is still being ingested; retry once it has completed")
+
+    try:
+        stored = await StorageService.upload_file(file, metadata={"user_corpus": file_doc.user_corpus, "user_email": user_email})
+    except FileTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+    if stored.content_hash == file_doc.content_hash and file_doc.status == "completed":
+        await StorageService.delete_file(stored.gridfs_id)
+        return {"message": "Unchanged", "file_id": file_id}
+
+    # The old blob is kept until the new version is ingested; a failed update leaves the old chunks in place
+    if not file_doc.previous_gridfs_id:
+        file_doc.previous_gridfs_id = file_doc.gridfs_id
+    elif file_doc.gridfs_id != file_doc.previous_gridfs_id:
+        # An earlier update that never completed is superseded
+        await StorageService.delete_file(file_doc.gridfs_id)
+    file_doc.gridfs_id = str(stored.gridfs_id)
+    file_doc.file_size = stored.size
+    file_doc.content_type = file.content_type or file_doc.content_type
+    file_doc.content_hash = stored.content_hash
+    file_doc.status = "pending"
+    file_doc.stage = "queued"
+    file_doc.chunks_total = None
+    file_doc.chunks_embedded = 0
+    file_doc.error_message = None
+    file_doc.updated_at = datetime.now()
+    await file_doc.save()
+
+    task = IngestionTask.for_file(file_doc)
+    await task.push()
+
+    return {"message": "Queued Update", "file_id": file_id}
+
+@router.get("/{file_id}/chunks", response_model=List[ChunkSummary])
+async def list_file_chunks(file_id: str, user_email: str, skip: int = 0, limit: int = 100):
+    await get_owned_file(file_id, user_email)
+
+    # Projection keeps the (large) embedding field off the wire
+    return await Chunk.find(Chunk.document_id == file_id).sort("chunk_index").skip(skip).limit(limit).project(ChunkSummary).to_list()
+
+@router.delete("/{file_id}")
+async def delete_file(file_id: str, user_email: str):
+    # 1. Verify ownership
+    file_doc = await get_owned_file(file_id, user_email)
         
-    # 2. Delete from GridFS
-    if file_doc.gridfs_id:
+    # 2. Delete from GridFS (incl. a version still being replaced)
+    for gridfs_id in {file_doc.gridfs_id, file_doc.previous_gridfs_id} - {None}:
         try:
-            await StorageService.delete_file(file_doc.gridfs_id)
+            await StorageService.delete_file(gridfs_id)
         except Exception as e:
-            print(f"Error deleting from GridFS: {e}")
+            logger.warning(f"Error deleting {gridfs_id} from GridFS: {e}")
     
-    # 3. Delete Chunks
+    # 3. Delete Chunks (server-side; no chunk bodies or embeddings are loaded)
     await Chunk.find(Chunk.document_id == file_id).delete()
+    index_sync.remove_document(file_doc.user_corpus, file_id)
+    await corpus_versions.bump(file_doc.user_corpus) # Cached answers may cite this file
     
     # 4. Delete Meta
     await file_doc.delete()
@@ -1,13 +1,39 @@
-from fastapi import FastAPI
+import asyncio
+from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 from src.db.mongo import db
+from src.config import get_settings
+from src.retrieval.index_sync import index_sync
+from src.retrieval.vector_index import vector_index
+from src.retrieval.bm25 import keyword_index
+from src.retrieval.rerank_cache import rerank_cache
+from src.retrieval.embedding_cache import embedding_cache
+from src.ingestion.progress import progress_hub
+from src.ingestion.text_chunker import get_tokenizer
+from src.services.metrics import format_server_timing, render_metrics, start_server_timing
 from src.routes import files, chat
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     await db.connect()
+
+    # In-process indexes are loaded before serving and then kept in sync with `chunks`
+    settings = get_settings()
+    if settings.VECTOR_BACKEND == "local":
+        index_sync.register(vector_index)
+    if settings.KEYWORD_BACKEND == "local":
+        index_sync.register(keyword_index)
+    index_sync.subscribe(rerank_cache)
+    await index_sync.start()
+    if settings.EMBEDDING_CACHE_SHARED:
+        await embedding_cache.ensure_index()
+    # /files/ingest-qa chunks small sessions in the request; don't load the tokenizer on the first one
+    await asyncio.to_thread(get_tokenizer, settings.CHUNK_TOKENIZER)
+
     yield
+    await progress_hub.stop()
+    await index_sync.stop()
     await db.close()
 
 app = FastAPI(title="Knowledge Capture API", version="1.0", lifespan=lifespan)
@@ -20,6 +46,16 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+if get_settings().SERVER_TIMING_ENABLED:
+    @app.middleware("http")
+    async def server_timing(request: Request, call_next):
+        timings = start_server_timing()
+        response = await call_next(request)
+        # Streaming responses only carry the stages finished before their headers went out
+        if timings:
+            response.headers["Server-Timing"] = format_server_timing(timings)
+        return response
+
 app.include_router(files.router)
 app.include_router(chat.router)
 
@@ -27,6 +63,11 @@ app.include_router(chat.router)
 def health():
     return {"status": "ok"}
 
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
 if __name__ == "__main__":
     import uvicorn
     import os
@@ -0,0 +1,85 @@
+import asyncio
+import mimetypes
+import os
+import tarfile
+import threading
+import zipfile
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import IO, Awaitable, Callable, Iterator, List
+
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")
+
+def is_archive(filename: str) -> bool:
+    return (filename or "").lower().endswith(ARCHIVE_SUFFIXES)
+
+def guess_content_type(filename: str) -> str:
+    return mimetypes.guess_type(filename)[0] or "application/octet-stream"
+
+def _is_junk(name: str) -> bool:
+    # OS metadata that ends up in archives made on macOS / Windows
+    base = os.path.basename(name)
+    return name.startswith("__MACOSX/") or base.startswith(".") or base == "Thumbs.db"
+
+@dataclass
+class ArchiveMember:
+    filename: str # Path inside the archive
+    content_type: str
+    read: Callable[[int], Awaitable[bytes]]
+
+@dataclass
+class ArchiveContents:
+    members: List[ArchiveMember]
+    # Tar members sit one after another in a (possibly compressed) stream, so reading them
+    # interleaved means re-decompressing from the start; they are read in order instead
+    sequential: bool
+
+class _Archive:
+    """Shared state of one open archive. Member reads are serialized, since they all seek the same file."""
+    def __init__(self, opened, open_member: Callable[[object], IO[bytes]]):
+        self.opened = opened
+        self.open_member = open_member
+        self.lock = threading.Lock()
+
+    def reader(self, info) -> Callable[[int], Awaitable[bytes]]:
+        handle = None
+
+        def read_sync(size: int) -> bytes:
+            nonlocal handle
+            with self.lock:
+                if handle is None:
+                    handle = self.open_member(info)
+                data = handle.read(size)
+                if not data:
+                    handle.close()
+                return data
+
+        async def read(size: int) -> bytes:
+            return await asyncio.to_thread(read_sync, size)
+        return read
+
+@contextmanager
+def open_archive(filename: str, fileobj: IO[bytes]) -> Iterator[ArchiveContents]:
+    """
+    List the regular files of a zip or tar archive (nested directories flattened, OS junk skipped).
+    Members are read lazily, in chunks, from worker threads; `fileobj` must be seekable.
+    """
+    if filename.lower().endswith(".zip"):
+        opened = zipfile.ZipFile(fileobj)
+        archive = _Archive(opened, opened.open)
+        infos = [(i, i.filename) for i in opened.infolist() if not i.is_dir()]
+    else:
+        opened = tarfile.open(fileobj=fileobj, mode="r:*")
+        archive = _Archive(opened, opened.extractfile)
+        infos = [(m, m.name) for m in opened.getmembers() if m.isfile()]
+
+    try:
+        yield ArchiveContents(
+            members=[
+                ArchiveMember(filename=name, content_type=guess_content_type(name), read=archive.reader(info))
+                for info, name in infos if not _is_junk(name)
+            ],
+            sequential=isinstance(opened, tarfile.TarFile),
+        )
+    finally:
+        opened.close()
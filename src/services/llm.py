@@ -1,19 +1,30 @@
 from litellm import acompletion
 from src.config import get_settings
 
-from typing import List, Dict, Optional
+from typing import AsyncIterator, List, Dict, Optional
 
 class LLMService:
+    ERROR_PREFIX = "Error generating answer:"
+
     @staticmethod
-    async def get_response(messages: List[Dict[str, str]], model: Optional[str] = None) -> str:
-        settings = get_settings()
-        
+    def is_error(response: Optional[str]) -> bool:
+        # A missing completion (None content) is no more an answer than an error message
+        return not isinstance(response, str) or response.startswith(LLMService.ERROR_PREFIX)
+
+    @staticmethod
+    def _resolve_model(model: Optional[str] = None) -> str:
         # Ensure correct prefix for LiteLLM
         if not model:
-            model = settings.GEMINI_MODEL
+            model = get_settings().GEMINI_MODEL
             
         if "gemini" in model.lower() and not model.startswith("gemini/"):
             model = f"gemini/{model}"
+        return model
+
+    @staticmethod
+    async def get_response(messages: List[Dict[str, str]], model: Optional[str] = None) -> str:
+        settings = get_settings()
+        model = LLMService._resolve_model(model)
 
         try:
             response = await acompletion(
@@ -23,4 +34,30 @@ class LLMService:
             )
             return response.choices[0].message.content
         except Exception as e:
-            return f"Error generating answer: {str(e)}"
+            return f"{LLMService.ERROR_PREFIX} {str(e)}"
+
+    @staticmethod
+    async def stream_response(messages: List[Dict[str, str]], model: Optional[str] = None) -> AsyncIterator[str]:
+        """
+        Yield completion text deltas as the model produces them.
+        Errors propagate to the caller; closing the generator closes the upstream stream.
+        """
+        settings = get_settings()
+        model = LLMService._resolve_model(model)
+
+        response = await acompletion(
+            model=model,
+            messages=messages,
+            api_key=settings.GEMINI_API_KEY,
+            stream=True
+        )
+        try:
+            async for chunk in response:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    yield delta
+        finally:
+            # Stops generation (and billing) when the consumer goes away early
+            await response.aclose()
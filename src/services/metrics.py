@@ -0,0 +1,103 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+# Covers both sub-millisecond local index lookups and multi-second LLM / parse calls
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+RETRIEVAL_STAGE_SECONDS = Histogram(
+    "retrieval_stage_seconds",
+    "Time spent per query-path stage (embed, vector, keyword, fusion, rerank, rewrite, llm)",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+
+INGESTION_STAGE_SECONDS = Histogram(
+    "ingestion_stage_seconds",
+    "Time spent per ingestion stage (download, parse, chunk, embed, insert)",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+
+DEGRADED_STAGES = Counter(
+    "retrieval_degraded_total",
+    "Search stages skipped or cut short because the request ran out of its deadline",
+    ["stage"],
+)
+
+DEDUP_FILES = Counter(
+    "ingestion_dedup_files_total",
+    "Ingested files by whether an identical stored file's chunks were reused (result=reused) or not (result=new)",
+    ["result"],
+)
+
+DEDUP_CHUNKS = Counter(
+    "ingestion_dedup_chunks_total",
+    "Embedded chunks by whether a stored embedding of identical text was reused (result=reused) or not (result=new)",
+    ["result"],
+)
+
+CACHE_LOOKUPS = Counter(
+    "cache_lookups_total",
+    "In-process cache lookups (cache=embedding|rerank|rewrite|answer) by result (hit, shared_hit for the Mongo embedding cache, miss)",
+    ["cache", "result"],
+)
+
+EMBED_BATCH_SIZE = Histogram(
+    "query_embed_batch_size",
+    "Callers coalesced into one query-embedding Voyage call",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+
+EMBED_BATCH_WAIT_SECONDS = Histogram(
+    "query_embed_batch_wait_seconds",
+    "Time a query embedding waited in the batcher before its Voyage call was sent",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25),
+)
+
+# Labelled by task priority, not tenant: user_corpus is unbounded and contains the user's email
+QUEUE_WAIT_SECONDS = Histogram(
+    "ingestion_queue_wait_seconds",
+    "Time an ingestion task waited in the queue before a worker claimed it",
+    ["priority"],
+    buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600, 7200, 14400, 43200, 86400),
+)
+
+QUEUE_PENDING = Gauge(
+    "ingestion_queue_pending",
+    "Ingestion tasks waiting in the queue, as last seen by this worker's scheduler",
+)
+
+# Per-request stage totals in ms, collected for the Server-Timing header when enabled
+_server_timing: ContextVar[Optional[Dict[str, float]]] = ContextVar("server_timing", default=None)
+
+def observe(stage: str, seconds: float, histogram: Histogram = RETRIEVAL_STAGE_SECONDS):
+    histogram.labels(stage=stage).observe(seconds)
+    timings = _server_timing.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds * 1000
+
+@contextmanager
+def timed(stage: str, histogram: Histogram = RETRIEVAL_STAGE_SECONDS) -> Iterator[None]:
+    """Time the enclosed block as `stage`. Works across awaits; child tasks share the request's timings."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start, histogram)
+
+def start_server_timing() -> Dict[str, float]:
+    timings: Dict[str, float] = {}
+    _server_timing.set(timings)
+    return timings
+
+def format_server_timing(timings: Dict[str, float]) -> str:
+    # Stages that ran several times in one request (e.g. multi-query) are summed
+    return ", ".join(f"{stage};dur={ms:.1f}" for stage, ms in timings.items())
+
+def render_metrics() -> tuple:
+    """Returns (body, content type) in the Prometheus text exposition format."""
+    return generate_latest(), CONTENT_TYPE_LATEST
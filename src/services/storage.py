@@ -1,34 +1,71 @@
+import os
+import hashlib
+import tempfile
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import AsyncIterator, Awaitable, Callable, Optional
 from motor.motor_asyncio import AsyncIOMotorGridFSBucket
 from fastapi import UploadFile
 from src.db.mongo import db
+from src.config import get_settings
 from bson import ObjectId
 
+class FileTooLargeError(Exception):
+    pass
+
+@dataclass
+class StoredFile:
+    gridfs_id: ObjectId
+    size: int
+    content_hash: str # sha256 hex digest of the raw bytes
+
 class StorageService:
     @staticmethod
-    async def upload_file(file: UploadFile, metadata: dict = None) -> ObjectId:
+    async def upload_file(file: UploadFile, metadata: dict = None) -> StoredFile:
+        return await StorageService.upload_stream(file.filename, file.read, metadata)
+
+    @staticmethod
+    async def upload_stream(filename: str, read: Callable[[int], Awaitable[bytes]], metadata: dict = None) -> StoredFile:
+        """Stream from `read(size)` into GridFS until it returns b"", hashing and size-checking on the way."""
         if not db.fs:
             raise Exception("DB not connected")
         
-        grid_in = db.fs.open_upload_stream(file.filename, metadata=metadata)
+        max_bytes = get_settings().MAX_UPLOAD_BYTES
+        grid_in = db.fs.open_upload_stream(filename, metadata=metadata)
         
-        while True:
-            chunk = await file.read(1024 * 1024) # 1MB chunks
-            if not chunk:
-                break
-            await grid_in.write(chunk)
+        size = 0
+        digest = hashlib.sha256()
+        try:
+            while True:
+                chunk = await read(1024 * 1024) # 1MB chunks
+                if not chunk:
+                    break
+                size += len(chunk)
+                if max_bytes and size > max_bytes:
+                    raise FileTooLargeError(f"File exceeds the {max_bytes} byte upload limit")
+                digest.update(chunk)
+                await grid_in.write(chunk)
+        except BaseException:
+            # Drop the chunks written so far
+            await grid_in.abort()
+            raise
             
         await grid_in.close()
-        return grid_in._id
+        return StoredFile(gridfs_id=grid_in._id, size=size, content_hash=digest.hexdigest())
 
     @staticmethod
-    async def upload_bytes(filename: str, content: bytes, metadata: dict = None) -> ObjectId:
+    async def upload_bytes(filename: str, content: bytes, metadata: dict = None) -> StoredFile:
         if not db.fs:
             raise Exception("DB not connected")
         
+        max_bytes = get_settings().MAX_UPLOAD_BYTES
+        if max_bytes and len(content) > max_bytes:
+            raise FileTooLargeError(f"File exceeds the {max_bytes} byte upload limit")
+
         grid_in = db.fs.open_upload_stream(filename, metadata=metadata)
         await grid_in.write(content)
         await grid_in.close()
-        return grid_in._id
+        return StoredFile(gridfs_id=grid_in._id, size=len(content), content_hash=hashlib.sha256(content).hexdigest())
 
     @staticmethod
     async def delete_file(file_id: str):
@@ -37,12 +74,34 @@ class StorageService:
         await db.fs.delete(ObjectId(file_id))
 
     @staticmethod
-    async def download_file(file_id: str) -> bytes:
+    @asynccontextmanager
+    async def download_to_tempfile(file_id: str, suffix: str = "", max_bytes: Optional[int] = None) -> AsyncIterator[str]:
+        """
+        Stream a GridFS file into a temporary file and yield its path.
+        The file is removed on exit, whether or not the caller succeeded.
+        """
         if not db.fs:
             raise Exception("DB not connected")
-        
+
         try:
             grid_out = await db.fs.open_download_stream(ObjectId(file_id))
-            return await grid_out.read()
         except Exception as e:
             raise Exception(f"File download failed: {e}")
+
+        if max_bytes and grid_out.length > max_bytes:
+            raise FileTooLargeError(f"File is {grid_out.length} bytes; the limit is {max_bytes}")
+
+        fd, path = tempfile.mkstemp(suffix=suffix)
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                while True:
+                    chunk = await grid_out.readchunk()
+                    if not chunk:
+                        break
+                    tmp.write(chunk)
+            yield path
+        finally:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,60 @@
+from typing import List, Optional, Union
+
+import numpy as np
+from bson.binary import Binary, BinaryVectorDtype
+
+from src.config import get_settings
+
+# BSON vector subtype (9) header: dtype byte followed by a padding byte
+VECTOR_SUBTYPE = 9
+FLOAT32_HEADER = BinaryVectorDtype.FLOAT32.value + b"\x00"
+INT8_HEADER = BinaryVectorDtype.INT8.value + b"\x00"
+PACKED_BIT_HEADER = BinaryVectorDtype.PACKED_BIT.value + b"\x00" # 1024 dims: no padding bits
+
+# Set bits per byte value, for Hamming distances over packed bit vectors
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint16)
+
+EmbeddingValue = Union[List[float], Binary]
+
+def pack_float32(values) -> Binary:
+    """Pack a vector as float32 BinData (subtype 9), the format Atlas vector search accepts."""
+    data = np.asarray(values, dtype="<f4").tobytes()
+    return Binary(FLOAT32_HEADER + data, subtype=VECTOR_SUBTYPE)
+
+def decode_embedding(value: EmbeddingValue) -> np.ndarray:
+    """Decode a stored embedding (BSON array or float32 BinData) into a float32 NumPy array."""
+    if isinstance(value, bytes):
+        if value[:1] != BinaryVectorDtype.FLOAT32.value:
+            raise ValueError(f"Unsupported vector dtype {value[:1]!r}")
+        # Zero-copy view over the BSON payload
+        return np.frombuffer(value, dtype="<f4", offset=2)
+    return np.asarray(value, dtype=np.float32)
+
+def encode_embedding(value: EmbeddingValue) -> EmbeddingValue:
+    """Encode an embedding for storage according to EMBEDDING_STORAGE ("array" or "binary")."""
+    if get_settings().EMBEDDING_STORAGE == "binary":
+        return value if isinstance(value, bytes) else pack_float32(value)
+    return decode_embedding(value).tolist() if isinstance(value, bytes) else value
+
+def quantize_binary(values) -> np.ndarray:
+    """Sign-bit quantization, packed 8 dims per byte (Voyage's `ubinary` layout)."""
+    return np.packbits(np.asarray(values, dtype=np.float32) > 0, axis=-1)
+
+def quantize_int8(values) -> np.ndarray:
+    """
+    Symmetric int8 quantization scaled per vector. The scale drops out of cosine
+    similarity, which is all the quantized stage is used for.
+    """
+    vector = np.asarray(values, dtype=np.float32)
+    peak = np.abs(vector).max(axis=-1, keepdims=True)
+    peak[peak == 0] = 1.0
+    return np.round(vector * (127.0 / peak)).astype(np.int8)
+
+def quantize_embedding(values, quantization: Optional[str] = None) -> Optional[Binary]:
+    """Quantized copy of an embedding as BSON vector BinData, per VECTOR_QUANTIZATION ("none", "binary", "int8")."""
+    quantization = quantization or get_settings().VECTOR_QUANTIZATION
+    if quantization == "binary":
+        return Binary(PACKED_BIT_HEADER + quantize_binary(decode_embedding(values)).tobytes(), subtype=VECTOR_SUBTYPE)
+    if quantization == "int8":
+        return Binary(INT8_HEADER + quantize_int8(decode_embedding(values)).tobytes(), subtype=VECTOR_SUBTYPE)
+    return None
@@ -0,0 +1,30 @@
+import voyageai
+from functools import lru_cache
+from typing import Iterable, Iterator, List, Tuple
+from src.config import get_settings
+
+@lru_cache
+def get_voyage_client() -> voyageai.Client:
+    # One client per process so the underlying HTTP session (and its connection pool) is reused
+    settings = get_settings()
+    return voyageai.Client(api_key=settings.VOYAGE_API_KEY)
+
+# Inputs per embed request accepted by Voyage
+VOYAGE_MAX_BATCH_ITEMS = 1000
+
+def estimate_tokens(text: str) -> int:
+    # Deliberately pessimistic (~3 chars per token) so batches stay under Voyage's limits
+    return len(text) // 3 + 1
+
+def make_batches(items: Iterable[Tuple[int, str]], max_tokens: int, max_items: int) -> Iterator[List[Tuple[int, str]]]:
+    """Split (index, text) pairs (e.g. chunk_index) into batches bounded by item count and estimated tokens."""
+    batch, batch_tokens = [], 0
+    for item in items:
+        tokens = estimate_tokens(item[1])
+        if batch and (len(batch) >= max_items or batch_tokens + tokens > max_tokens):
+            yield batch
+            batch, batch_tokens = [], 0
+        batch.append(item)
+        batch_tokens += tokens
+    if batch:
+        yield batch
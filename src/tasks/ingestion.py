@@ -1,9 +1,63 @@
+import logging
+from typing import Optional
+
 from beanie_batteries_queue import Task
+from beanie_batteries_queue.task import Priority
+from pymongo import ASCENDING, DESCENDING
+
+from src.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+# Parsed without layout analysis and embedded in a batch or two; never worth queueing behind a big PDF
+TEXT_CONTENT_TYPES = ("text/markdown", "text/plain", "text/csv")
+
+def ingestion_priority(content_type: Optional[str], file_size: int) -> Priority:
+    """Small and plain-text files first, very large files last."""
+    settings = get_settings()
+    if (content_type or "").split(";")[0] in TEXT_CONTENT_TYPES or file_size <= settings.INGESTION_SMALL_FILE_BYTES:
+        return Priority.HIGH
+    if file_size >= settings.INGESTION_LARGE_FILE_BYTES:
+        return Priority.LOW
+    return Priority.MEDIUM
 
 class IngestionTask(Task):
     file_id: str
+    user_corpus: Optional[str] = None # Fair-share key; None for tasks queued before it existed
+
+    class Settings(Task.Settings):
+        indexes = Task.Settings.indexes + [
+            # FairScheduler claims per tenant in priority, then FIFO, order
+            [
+                ("state", ASCENDING),
+                ("user_corpus", ASCENDING),
+                ("priority", DESCENDING),
+                ("created_at", ASCENDING),
+            ],
+        ]
+
+    @classmethod
+    def for_file(cls, file_doc) -> "IngestionTask":
+        return cls(
+            file_id=str(file_doc.id),
+            user_corpus=file_doc.user_corpus,
+            priority=ingestion_priority(file_doc.content_type, file_doc.file_size),
+        )
+
+    async def abandon(self):
+        """Called by FairScheduler when workers kept dying on this task; the file would otherwise stay pending."""
+        from beanie import PydanticObjectId
+        from src.ingestion.progress import ProgressReporter
+        from src.ingestion.service import IngestionService
+        from src.models.files import FileMetadata
+        file_meta = await FileMetadata.get(self.file_id)
+        if file_meta and file_meta.previous_gridfs_id is None:
+            await IngestionService.discard_partial(file_meta)
+        await ProgressReporter(PydanticObjectId(self.file_id)).update(
+            status="failed", stage="failed", error_message="Ingestion was interrupted repeatedly (worker crashed or restarted)"
+        )
 
     async def run(self):
         from src.ingestion.service import IngestionService
-        print(f"Processing Ingestion Task for File: {self.file_id}")
+        logger.info(f"Processing ingestion task for file {self.file_id}")
         await IngestionService.process_document(self.file_id)
@@ -0,0 +1,199 @@
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Set, Tuple, Type
+
+from beanie_batteries_queue import Task
+from beanie_batteries_queue.task import State
+from pymongo import ReturnDocument
+
+from src.services.metrics import QUEUE_PENDING, QUEUE_WAIT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+class FairScheduler:
+    """
+    Runs queued tasks with per-tenant (user_corpus) fair sharing, replacing the strict
+    priority/FIFO order of beanie_batteries_queue's Worker.
+
+    Each free slot goes to the tenant with the fewest tasks running across all workers,
+    then to the tenant whose best waiting task has the highest priority, then to the one
+    waiting longest. Within a tenant, tasks run by priority, then FIFO. Claims are atomic,
+    so several workers can share the queue.
+
+    Running tasks hold a lease that their worker renews every lease_seconds / 4. A task whose
+    lease ran out (its worker crashed or was killed) is requeued, so it neither counts against
+    its tenant nor stays unfinished; after max_requeues it is failed instead, and the task's
+    optional abandon() hook is called. Each claim gets its own lease id; renewals and the final
+    FINISHED / FAILED write only apply while the task still holds that lease, so a worker that
+    overran its lease can't overwrite the state of the task's next run.
+    """
+    def __init__(self, task_class: Type[Task], concurrency: int, poll_seconds: float = 1.0, max_per_tenant: int = 0,
+                 lease_seconds: float = 120.0, max_requeues: int = 2):
+        self.task_class = task_class
+        self.concurrency = max(1, concurrency)
+        self.poll_seconds = poll_seconds
+        self.max_per_tenant = max_per_tenant # 0: a tenant may use every free slot
+        self.lease = timedelta(seconds=lease_seconds)
+        self.max_requeues = max_requeues
+        self.running = False
+        self._active: Set[asyncio.Task] = set()
+        self._claimed: Dict[Any, str] = {} # Lease id of each task this worker is running, by task id
+        self._heartbeat_task: asyncio.Task = None
+
+    def _collection(self):
+        return self.task_class.get_motor_collection()
+
+    async def start(self):
+        self.running = True
+        logger.info(f"Fair scheduler started with {self.concurrency} slot(s)")
+        self._heartbeat_task = asyncio.create_task(self._heartbeat())
+        try:
+            while self.running:
+                free = self.concurrency - len(self._active)
+                claimed = await self._fill(free) if free > 0 else 0
+                if self._active and (claimed or free <= 0):
+                    # Re-plan as soon as a slot frees up (or periodically, to pick up new tenants)
+                    await asyncio.wait(self._active, timeout=self.poll_seconds, return_when=asyncio.FIRST_COMPLETED)
+                elif not claimed:
+                    await asyncio.sleep(self.poll_seconds)
+        finally:
+            if self._active:
+                await asyncio.gather(*self._active, return_exceptions=True)
+            self._heartbeat_task.cancel()
+
+    def stop(self):
+        self.running = False
+
+    async def _heartbeat(self):
+        interval = self.lease.total_seconds() / 4
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if self._claimed:
+                    # Task.created_at is naive UTC; leases use the same clock
+                    await self._collection().update_many(
+                        {"state": State.RUNNING.value, "$or": [
+                            {"_id": task_id, "lease_id": lease_id} for task_id, lease_id in self._claimed.items()
+                        ]},
+                        {"$set": {"heartbeat_at": datetime.utcnow()}},
+                    )
+                await self._requeue_expired()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Task lease renewal failed: {e}")
+
+    async def _requeue_expired(self):
+        """Requeue running tasks whose worker stopped renewing their lease; fail those requeued too often."""
+        expired = {"state": State.RUNNING.value, "heartbeat_at": {"$not": {"$gt": datetime.utcnow() - self.lease}}}
+        while True:
+            doc = await self._collection().find_one_and_update(
+                {**expired, "requeues": {"$gte": self.max_requeues}},
+                {"$set": {"state": State.FAILED.value}},
+                return_document=ReturnDocument.AFTER,
+            )
+            if doc is None:
+                break
+            task = self.task_class.model_validate(doc)
+            logger.error(f"Task {task.id} lost its worker {doc['requeues'] + 1} times; giving up")
+            abandon = getattr(task, "abandon", None)
+            if abandon is not None:
+                await abandon()
+
+        result = await self._collection().update_many(
+            expired, {"$set": {"state": State.CREATED.value}, "$unset": {"lease_id": ""}, "$inc": {"requeues": 1}}
+        )
+        if result.modified_count:
+            logger.warning(f"Requeued {result.modified_count} task(s) whose worker stopped renewing their lease")
+
+    async def _tenants(self) -> List[Dict[str, Any]]:
+        """Pending and running counts per tenant, plus the best waiting priority and the oldest wait."""
+        pipeline = [
+            {"$match": {"state": {"$in": [State.CREATED.value, State.RUNNING.value]}}},
+            {"$group": {
+                "_id": "$user_corpus",
+                "pending": {"$sum": {"$cond": [{"$eq": ["$state", State.CREATED.value]}, 1, 0]}},
+                "running": {"$sum": {"$cond": [{"$eq": ["$state", State.RUNNING.value]}, 1, 0]}},
+                "top_priority": {"$max": {"$cond": [{"$eq": ["$state", State.CREATED.value]}, "$priority", None]}},
+                "oldest": {"$min": {"$cond": [{"$eq": ["$state", State.CREATED.value]}, "$created_at", None]}},
+            }},
+        ]
+        tenants = await self._collection().aggregate(pipeline).to_list(length=None)
+        QUEUE_PENDING.set(sum(t["pending"] for t in tenants))
+        return [t for t in tenants if t["pending"] > 0]
+
+    async def _fill(self, free: int) -> int:
+        tenants = await self._tenants()
+        claimed = 0
+        while free > 0 and tenants:
+            tenants.sort(key=lambda t: (t["running"], -(t["top_priority"] or 0), t["oldest"] or datetime.max))
+            tenant = tenants[0]
+            if self.max_per_tenant and tenant["running"] >= self.max_per_tenant:
+                # Sorted by running count, so every other tenant is at the cap too
+                break
+
+            claim = await self._claim(tenant["_id"])
+            if claim is None:
+                # Another worker took the rest
+                tenants.pop(0)
+                continue
+
+            tenant["running"] += 1
+            tenant["pending"] -= 1
+            if tenant["pending"] <= 0:
+                tenants.pop(0)
+            self._launch(*claim)
+            free -= 1
+            claimed += 1
+        return claimed
+
+    async def _claim(self, user_corpus: Optional[str]) -> Optional[Tuple[Task, str]]:
+        lease_id = uuid.uuid4().hex
+        doc = await self._collection().find_one_and_update(
+            {"state": State.CREATED.value, "user_corpus": user_corpus},
+            {"$set": {"state": State.RUNNING.value, "heartbeat_at": datetime.utcnow(), "lease_id": lease_id}},
+            sort=[("priority", -1), ("created_at", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+        if doc is None:
+            return None
+        task = self.task_class.model_validate(doc)
+        # Task.created_at is naive UTC
+        QUEUE_WAIT_SECONDS.labels(priority=task.priority.name.lower()).observe((datetime.utcnow() - task.created_at).total_seconds())
+        return task, lease_id
+
+    def _launch(self, task: Task, lease_id: str):
+        self._claimed[task.id] = lease_id
+        runner = asyncio.create_task(self._run(task, lease_id))
+        self._active.add(runner)
+        runner.add_done_callback(self._active.discard)
+
+    async def _run(self, task: Task, lease_id: str):
+        # Same contract as beanie_batteries_queue's Queue, but Task.finish() / fail() would save()
+        # the whole document over a newer claim of the task
+        try:
+            await task.run()
+            state = State.FINISHED
+        except Exception as e:
+            logger.error(f"Task {task.id} failed: {e}")
+            state = State.FAILED
+        try:
+            await self._complete(task, lease_id, state)
+        except Exception as e:
+            # Still RUNNING; the lease runs out and the task is requeued
+            logger.error(f"Could not record the result of task {task.id}: {e}")
+        finally:
+            self._claimed.pop(task.id, None)
+
+    async def _complete(self, task: Task, lease_id: str, state: State):
+        result = await self._collection().update_one(
+            {"_id": task.id, "state": State.RUNNING.value, "lease_id": lease_id},
+            {"$set": {"state": state.value}},
+        )
+        if result.matched_count == 0:
+            # Requeued after the lease ran out (and maybe running elsewhere); that run owns the task now
+            logger.warning(f"Task {task.id} lost its lease while running; leaving its {state.value} result unrecorded")
+        else:
+            task.state = state
@@ -1,8 +1,11 @@
 import asyncio
 import logging
 from src.db.mongo import db
-from beanie_batteries_queue import Worker
 from src.tasks.ingestion import IngestionTask
+from src.tasks.scheduler import FairScheduler
+from src.ingestion.parser_pool import parser_pool
+from src.config import get_settings
+from src.services.metrics import render_metrics
 
 logging.basicConfig(level=logging.INFO)
 # Suppress noisy docling logs
@@ -16,6 +19,13 @@ from http.server import HTTPServer, BaseHTTPRequestHandler
 
 class HealthHandler(BaseHTTPRequestHandler):
     def do_GET(self):
+        if self.path == "/metrics":
+            body, content_type = render_metrics()
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.end_headers()
+            self.wfile.write(body)
+            return
         self.send_response(200)
         self.end_headers()
         self.wfile.write(b"OK")
@@ -30,12 +40,26 @@ def start_health_check():
     logger.info(f"Health check server listening on port {port}")
 
 async def run():
+    settings = get_settings()
+    # Warm the parser processes before taking tasks so no document pays the model load
+    parser_pool.start(settings.PARSER_POOL_SIZE)
     
     await db.connect()
     logger.info("Worker started.")
     
-    worker = Worker(task_classes=[IngestionTask])
-    await worker.start()
+    try:
+        # Per-tenant fair share over prioritized tasks; claims are atomic across workers
+        scheduler = FairScheduler(
+            IngestionTask,
+            concurrency=settings.INGESTION_CONCURRENCY,
+            poll_seconds=settings.INGESTION_POLL_SECONDS,
+            max_per_tenant=settings.INGESTION_MAX_PER_TENANT,
+            lease_seconds=settings.INGESTION_LEASE_SECONDS,
+            max_requeues=settings.INGESTION_MAX_REQUEUES,
+        )
+        await scheduler.start()
+    finally:
+        parser_pool.shutdown()
 
 if __name__ == "__main__":
     # Start the dummy server immediately to satisfy Render's port binding requirement